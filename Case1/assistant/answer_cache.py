@@ -0,0 +1,142 @@
+"""
+Семантический кэш ответов ассистента на повторяющиеся вопросы абитуриентов
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Минимальная косинусная близость вопросов, при которой возвращается кэшированный ответ
+SIMILARITY_THRESHOLD = 0.92
+TTL_SECONDS = 24 * 60 * 60
+MAX_SIZE = 1000
+# Короткие реплики ("а на платное?") зависят от контекста диалога и в кэш не попадают.
+# По той же причине кэш не используется для вопросов в треде, где уже есть история
+MIN_WORDS = 3
+
+SPACES_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(question):
+    return SPACES_PATTERN.sub(" ", question.lower().replace("ё", "е")).strip(" ?!.")
+
+
+class CacheEntry:
+    def __init__(self, question, vector, answer):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.created = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """Кэш ответов с поиском по близости эмбеддингов вопросов.
+
+    Записи вытесняются по TTL и по LRU при превышении max_size. Кэш привязан
+    к ID поискового индекса и очищается, когда индекс меняется.
+    """
+
+    def __init__(self, embedder, threshold=SIMILARITY_THRESHOLD, ttl=TTL_SECONDS, max_size=MAX_SIZE,
+                 index_id=None):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.index_id = index_id
+        self._entries = OrderedDict()
+        # Матрица эмбеддингов и соответствующие ей ключи, пересобираются после изменения состава
+        self._matrix = None
+        self._keys = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_cacheable(self, question, followup=False):
+        """followup - вопрос задан в продолжение диалога, и ответ на него зависит от предыдущих реплик"""
+        return not followup and len(question.split()) >= MIN_WORDS
+
+    def ensure_index(self, index_id):
+        """Очистка кэша, если ответы были получены по другому поисковому индексу"""
+        with self._lock:
+            if index_id != self.index_id:
+                self.index_id = index_id
+                self._clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if now - entry.created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+        if expired:
+            self._matrix = None
+
+    def get(self, question, followup=False):
+        """Кэшированный ответ на близкий вопрос или None"""
+        if not self.is_cacheable(question, followup):
+            self.bypassed += 1
+            return None
+        key = normalize_question(question)
+        with self._lock:
+            self._expire()
+            if key not in self._entries and not self._entries:
+                self.misses += 1
+                return None
+        vector = None if key in self._entries else self.embedder([question])[0]
+        with self._lock:
+            if key not in self._entries and vector is not None and self._entries:
+                if self._matrix is None:
+                    self._keys = list(self._entries)
+                    self._matrix = np.stack([self._entries[k].vector for k in self._keys])
+                scores = self._matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = self._keys[best]
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.answer
+
+    def put(self, question, answer, followup=False):
+        """answer - любое значение ответа (в Agent - AgentReply), хранится как есть"""
+        if not self.is_cacheable(question, followup) or not answer:
+            return
+        key = normalize_question(question)
+        vector = self.embedder([question])[0]
+        with self._lock:
+            self._entries[key] = CacheEntry(question, vector, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,11 +1,16 @@
 from yandex_cloud_ml_sdk import YCloudML
 from config import Config
+from assistant.local_search import LocalSearchIndex, SentenceTransformerEmbedder
+from assistant.answer_cache import SemanticAnswerCache
+from assistant.pool import AssistantPool
 import os
 
 
 config = Config(_env_file=os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 sdk = YCloudML(folder_id=config.folder_id, auth=config.api_key)
 model = sdk.models.completions("yandexgpt", model_version="rc")
+# Ассистенты общие для всех пользователей, у каждого пользователя только свой тред
+assistant_pool = AssistantPool(sdk)
 
 instruction="""Ты сотрудник приемной комиссии Московского Авиационного Института (МАИ). 
 Твоя задача консультировать абитуриентов по вопросам по поводу поступления или самого института, а также определять, 
@@ -14,4 +19,14 @@ instruction="""Ты сотрудник приемной комиссии Мос
 функцию HandOver Посмотри на всю имеющуюся в твоем распоряжении информацию
 и сделай самый понятный и достоверный ответ. Не упоминай, что что-то можно уточнить в приемной комиссии. 
 Если что-то непонятно - переспроси"""
-search_index = sdk.search_indexes.get(config.search_index_id)
\ No newline at end of file
+if config.local_index_path:
+    search_index = LocalSearchIndex.load(config.local_index_path)
+else:
+    search_index = sdk.search_indexes.get(config.search_index_id)
+
+# Общий для всех пользователей кэш ответов на повторяющиеся вопросы
+answer_cache = None
+if config.answer_cache:
+    answer_cache = SemanticAnswerCache(SentenceTransformerEmbedder(), threshold=config.answer_cache_threshold,
+                                       ttl=config.answer_cache_ttl, max_size=config.answer_cache_size,
+                                       index_id=search_index.id)
@@ -0,0 +1,156 @@
+"""
+Каталог направлений с кэшем в колоночном формате и подхватом обновлений MAI_Programs.xlsx без перезапуска.
+
+Excel читается только при изменении исходного файла; результат сохраняется в Arrow IPC (Feather)
+без сжатия и при следующих запусках читается через memory map. ProgramIndex работает с DataFrame,
+поэтому to_pandas() всё равно копирует колонки в память: выигрыш - в том, что не разбирается Excel,
+а не в разделяемых страницах файла. Без pyarrow (см. requirements.txt) кэш сохраняется в pickle.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import pandas as pd
+
+from assistant.programs import COLUMNS, ProgramIndex
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 30
+TEXT_COLUMNS = ['Code', 'Name', 'Exams', 'Faq', 'Courses']
+SCORE_COLUMNS = ['Budget-points', 'Paid-points']
+
+try:
+    from pyarrow import feather
+except ImportError:
+    feather = None
+
+
+def source_signature(path):
+    """Размер и время изменения файла; None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def normalize_table(table):
+    """Приведение таблицы к колонкам COLUMNS и однородным типам, пригодным для колоночного формата"""
+    table = table.copy()
+    table.columns = COLUMNS
+    for column in TEXT_COLUMNS:
+        table[column] = table[column].fillna('').astype(str)
+    for column in SCORE_COLUMNS:
+        table[column] = pd.to_numeric(table[column], errors='coerce')
+    return table.reset_index(drop=True)
+
+
+class ProgramCatalogue:
+    """Каталог направлений: ProgramIndex поверх актуальной версии MAI_Programs.xlsx.
+
+    Новая версия каталога собирается целиком и подменяется одним присваиванием ссылки,
+    поэтому вызовы SearchProgramsList, начавшиеся до обновления, дорабатывают со старым индексом.
+    """
+
+    def __init__(self, source, cache_dir, poll_interval=POLL_INTERVAL):
+        self.source = str(source)
+        self.cache_dir = str(cache_dir)
+        self.poll_interval = poll_interval
+        suffix = 'arrow' if feather is not None else 'pkl'
+        self.cache_path = os.path.join(self.cache_dir, f'programs.{suffix}')
+        logger.info(f"Кэш каталога: {'Arrow IPC (Feather)' if feather is not None else 'pickle, pyarrow не установлен'}")
+        self.meta_path = os.path.join(self.cache_dir, 'programs.meta.json')
+        self.signature = None
+        self._failed_signature = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.index = ProgramIndex(pd.DataFrame(columns=COLUMNS))
+        self.reload()
+
+    @property
+    def table(self):
+        return self.index.table
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, json.JSONDecodeError):
+            return {}
+
+    def _read_cache(self):
+        if feather is not None:
+            return feather.read_table(self.cache_path, memory_map=True).to_pandas()
+        return pd.read_pickle(self.cache_path)
+
+    def _write_cache(self, table, signature):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{self.cache_path}.tmp'
+        if feather is not None:
+            # Без сжатия, чтобы файл можно было отображать в память
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+        else:
+            table.to_pickle(tmp_path)
+        os.replace(tmp_path, self.cache_path)
+        tmp_path = f'{self.meta_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'source': self.source, 'signature': signature}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _load(self, signature):
+        """Таблица из кэша, если он собран из этой версии источника, иначе из Excel с пересборкой кэша"""
+        meta = self._read_meta()
+        if meta.get('source') == self.source and meta.get('signature') == signature \
+                and os.path.exists(self.cache_path):
+            try:
+                return self._read_cache()
+            except Exception as e:
+                logger.warning(f"Кэш каталога повреждён, читаю Excel: {e}")
+        table = normalize_table(pd.read_excel(self.source))
+        try:
+            self._write_cache(table, signature)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить кэш каталога: {e}")
+        return table
+
+    def reload(self, force=False):
+        """Перечитывает каталог, если источник изменился. Возвращает True при подмене индекса"""
+        with self._reload_lock:
+            signature = source_signature(self.source)
+            if signature is None:
+                if self.signature is None:
+                    print(f"Warning: Excel file not found at {self.source}")
+                return False
+            if signature in (self.signature, self._failed_signature) and not force:
+                return False
+            try:
+                index = ProgramIndex(self._load(signature))
+            except Exception as e:
+                # Недописанный или битый файл: остаёмся на текущей версии до следующего изменения источника
+                print(f"Error loading Excel file: {e}")
+                self._failed_signature = signature
+                return False
+            self.index = index
+            self.signature = signature
+            return True
+
+    def watch(self, poll_interval=None):
+        """Фоновая проверка источника на изменения"""
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name='catalogue-watch', daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            if self.reload():
+                logger.info(f"Каталог направлений обновлён: {len(self.index)} направлений")
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,74 @@
+"""
+Локальное хранилище чанков поискового индекса, адресуемых по хэшу содержимого
+"""
+
+import json
+import os
+
+
+class ChunkStore:
+    """Состояние поискового индекса: хэш чанка -> ID загруженного файла.
+
+    Хранит ID индекса, чанки, которые в него добавлены, и файлы удалённых чанков,
+    которые остаются в индексе до следующей полной пересборки (API индекса
+    не умеет удалять из него отдельные файлы).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_id = None
+        self.indexed = {}
+        self.stale = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            print(f"Ошибка при чтении хранилища чанков: {e}")
+            return
+        self.index_id = data.get("index_id")
+        self.indexed = data.get("indexed", {})
+        self.stale = data.get("stale", [])
+
+    def save(self):
+        """Атомарная запись состояния через временный файл"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {"index_id": self.index_id, "indexed": self.indexed, "stale": self.stale}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def diff(self, keys):
+        """Ключи чанков, которых нет в индексе, и ключи, которые из корпуса пропали"""
+        current = set(keys)
+        added = [key for key in dict.fromkeys(keys) if key not in self.indexed]
+        removed = [key for key in self.indexed if key not in current]
+        return added, removed
+
+    def stale_ratio(self, removed=()):
+        """Доля устаревших файлов в индексе после удаления removed"""
+        stale = len(self.stale) + len(removed)
+        total = len(self.indexed) + len(self.stale)
+        return stale / total if total else 0.0
+
+    def add(self, keys, file_ids):
+        self.indexed.update(zip(keys, file_ids))
+
+    def remove(self, keys):
+        for key in keys:
+            file_id = self.indexed.pop(key, None)
+            if file_id:
+                self.stale.append(file_id)
+
+    def reset(self, index_id, keys, file_ids):
+        """Состояние после полной пересборки индекса"""
+        self.index_id = index_id
+        self.indexed = dict(zip(keys, file_ids))
+        self.stale = []
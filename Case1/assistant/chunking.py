@@ -0,0 +1,173 @@
+"""
+Разбиение файлов базы знаний на чанки для поискового индекса
+"""
+
+import os
+import re
+from glob import glob
+
+from assistant.md_tables import iter_facts, iter_docs, iter_chats
+from assistant.tokens import TokenEstimator
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+# Бюджет чанка: с запасом до max_chunk_size_tokens индекса, чтобы индекс не резал чанк
+CHUNK_TOKENS = 800
+CHAT_CHUNK_TOKENS = CHUNK_TOKENS
+# Сколько последних диалогов чанка повторяется в начале следующего (по benchmarks/bench_retrieval.py
+# перекрытие не улучшает полноту поиска, но добавляет чанков)
+CHAT_OVERLAP = 0
+
+MESSAGE_ID_PATTERN = re.compile(r"ID (\d+)")
+
+
+def get_files(data_dir=DATA_DIR):
+    """Получение списка всех файлов базы знаний"""
+    files = []
+    # Файлы из директорий chats, facts и docs
+    for category in ("chats", "facts", "docs"):
+        for fn in glob(os.path.join(data_dir, category, "*.md")):
+            if os.path.isfile(fn):
+                files.append(fn)
+    return sorted(files)
+
+
+def get_category(filename):
+    """Тип файла по пути: chats, docs или facts"""
+    if "facts" in filename:
+        return "facts"
+    elif "docs" in filename:
+        return "docs"
+    return "chats"
+
+
+def chunk_file(filename, estimator=None):
+    """Разбиение файла на чанки в зависимости от его типа.
+
+    estimator - оценка токенов по замеренному соотношению символов и токенов: по ней упаковываются
+    чаты, а слишком длинные факты и документы режутся на части не больше CHUNK_TOKENS токенов.
+    """
+    category = get_category(filename)
+    with open(filename, "r", encoding="utf-8") as f:
+        if category == "chats":
+            return pack_chats(f, estimator=estimator)
+        chunks = chunk_facts(f) if category == "facts" else chunk_docs(f)
+    if estimator is None:
+        return chunks
+    return split_long(chunks, estimator.chunk_size(CHUNK_TOKENS, category))
+
+
+def split_long(chunks, max_chars):
+    """Чанки длиннее max_chars символов режутся по переводам строк, а если их нет - по пробелам"""
+    result = []
+    for chunk in chunks:
+        while len(chunk) > max_chars:
+            cut = chunk.rfind("\n", max_chars // 2, max_chars)
+            if cut <= 0:
+                cut = chunk.rfind(" ", max_chars // 2, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            result.append(chunk[:cut].strip())
+            chunk = chunk[cut:].strip()
+        if chunk:
+            result.append(chunk)
+    return result
+
+
+def format_fact(row):
+    return f"""Категория: {row.category}
+Факт: {row.fact}"""
+
+
+def format_doc(row):
+    return f"""Ключевые слова: {row.keywords}
+Вопрос: {row.question}
+Ответ: {row.answer}"""
+
+
+def format_messages(messages):
+    """Метаданные первого сообщения и текст всех сообщений ячейки"""
+    if not messages:
+        return "", ""
+    return messages[0].meta, "\n".join(message.text for message in messages)
+
+
+def format_exchange(row):
+    """Вопрос и ответ диалога с метаданными сообщений"""
+    metadata, question = format_messages(row.question)
+    answer_metadata, answer = format_messages(row.answer)
+    return f"""Вопрос ({metadata}):
+{question}
+
+Ответ ({answer_metadata}):
+{answer}"""
+
+
+def format_dialog(row):
+    return f"""Год: {row.year}
+{format_exchange(row)}"""
+
+
+def dialog_id(row):
+    """ID первого сообщения вопроса или номер строки, если ID в метаданных нет"""
+    match = MESSAGE_ID_PATTERN.search(row.question[0].meta) if row.question else None
+    return match.group(1) if match else f"L{row.line_no}"
+
+
+def format_pack(year, rows, exchanges):
+    return f"""Год: {year}
+Диалоги: ID {dialog_id(rows[0])} - ID {dialog_id(rows[-1])}
+
+""" + "\n\n---\n\n".join(exchanges)
+
+
+def chunk_facts(lines):
+    """Разбиение файла с фактами на чанки: каждая непустая ячейка - отдельный факт"""
+    return [format_fact(row) for row in iter_facts(lines)]
+
+
+def chunk_docs(lines):
+    """Разбиение файла с документами на чанки: каждая строка таблицы - вопрос и ответ"""
+    return [format_doc(row) for row in iter_docs(lines)]
+
+
+def chunk_chats(lines):
+    """Разбиение файла с чатами на чанки: каждый диалог - отдельный чанк"""
+    return [format_dialog(row) for row in iter_chats(lines)]
+
+
+def pack_chats(lines, max_tokens=CHAT_CHUNK_TOKENS, overlap=CHAT_OVERLAP, estimator=None):
+    """Упаковка подряд идущих диалогов одного года в чанки не больше max_tokens токенов.
+
+    В заголовке чанка - год и ID первого и последнего диалога. Последние overlap диалогов
+    чанка повторяются в начале следующего. Диалог длиннее бюджета становится отдельным чанком.
+    """
+    estimator = estimator or TokenEstimator()
+    chunks = []
+    year, rows, exchanges, sizes = None, [], [], []
+    # Запас на заголовок чанка и разделители
+    header_tokens = estimator.estimate("Год: 0000\nДиалоги: ID 00000 - ID 00000\n\n", "chats")
+    separator_tokens = estimator.estimate("\n\n---\n\n", "chats")
+
+    def flush():
+        chunks.append(format_pack(year, rows, exchanges))
+
+    for row in iter_chats(lines):
+        exchange = format_exchange(row)
+        size = estimator.estimate(exchange, "chats") + separator_tokens
+        if rows and (row.year != year or header_tokens + sum(sizes) + size > max_tokens):
+            flush()
+            if row.year != year:
+                keep = 0
+            else:
+                # Перекрытие, которое помещается в бюджет вместе с новым диалогом
+                keep = min(overlap, len(rows) - 1) if overlap else 0
+                while keep and header_tokens + sum(sizes[-keep:]) + size > max_tokens:
+                    keep -= 1
+            rows, exchanges, sizes = (rows[-keep:], exchanges[-keep:], sizes[-keep:]) if keep else ([], [], [])
+        year = row.year
+        rows.append(row)
+        exchanges.append(exchange)
+        sizes.append(size)
+    if rows:
+        flush()
+    return chunks
@@ -0,0 +1,88 @@
+"""
+Кэш на диске для повторяемых вызовов моделей (ответы LLM-судьи, эмбеддинги) во встроенной SQLite
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+'''
+
+
+def cache_key(*parts):
+    """sha256 от JSON-представления частей ключа (промпт, конфигурация модели и т.п.)"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DiskCache:
+    """Ключ -> значение в формате JSON, разделённые по пространствам имён.
+
+    Безопасен для использования из нескольких потоков; значения переживают перезапуск,
+    поэтому повторный прогон платит только за новые запросы.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key)
+
+    def get_many(self, namespace, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Не больше 500 параметров в одном запросе
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self.conn.execute(
+                    f'SELECT key, value FROM cache WHERE namespace = ? AND key IN ({",".join("?" * len(batch))})',
+                    [namespace, *batch]).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, namespace, key, value):
+        self.put_many(namespace, {key: value})
+
+    def put_many(self, namespace, items):
+        now = time.time()
+        rows = [(namespace, key, json.dumps(value, ensure_ascii=False), now) for key, value in items.items()]
+        with self._lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO cache(namespace, key, value, created) VALUES (?, ?, ?, ?)',
+                                  rows)
+
+    def clear(self, namespace=None):
+        with self._lock, self.conn:
+            if namespace is None:
+                self.conn.execute('DELETE FROM cache')
+            else:
+                self.conn.execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -1,24 +1,20 @@
 from pydantic import BaseModel, Field
 import pandas as pd
 import os
+import time
 from pathlib import Path
+from typing import NamedTuple
+from assistant.local_search import LocalSearchIndex, make_search_tool
+from assistant.catalogue import ProgramCatalogue
+from assistant.pool import is_not_found
+from assistant.tracing import tracer
 
 # Get the absolute path to the project root
 project_root = Path(__file__).parent.parent
 excel_path = project_root / 'knowledge_base' / 'MAI_Programs.xlsx'
 
-try:
-    if excel_path.exists():
-        tb = pd.read_excel(excel_path)
-        tb.columns = ['Code', 'Name', 'Budget-points', 'Paid-points', 'Exams', 'Faq', 'Courses']
-    else:
-        print(f"Warning: Excel file not found at {excel_path}")
-        # Create an empty DataFrame with the required columns
-        tb = pd.DataFrame(columns=['Code', 'Name', 'Budget-points', 'Paid-points', 'Exams', 'Faq', 'Courses'])
-except Exception as e:
-    print(f"Error loading Excel file: {e}")
-    # Create an empty DataFrame with the required columns
-    tb = pd.DataFrame(columns=['Code', 'Name', 'Budget-points', 'Paid-points', 'Exams', 'Faq', 'Courses'])
+# Каталог читается из кэша; изменения Excel подхватываются после catalogue.watch()
+catalogue = ProgramCatalogue(excel_path, project_root / 'data' / 'cache')
 
 
 def create_thread(sdk):
@@ -34,6 +30,11 @@ def create_assistant(sdk, model, tools=None):
     )
 
 
+# Функции, результат которых зависит от данных пользователя или меняет состояние диалога:
+# ответы с их вызовом не кэшируются. Поиск по базе знаний только читает индекс
+STATEFUL_TOOLS = ('SearchProgramsList', 'HandOver')
+
+
 def upload_file(sdk, filename):
     return sdk.files.upload(filename, ttl_days=1, expiration_policy="static")
 
@@ -60,34 +61,8 @@ class SearchProgramsList(BaseModel):
         return sort_table(self)
 
 
-def sort_table(req, table=tb):
-    x = table.copy()
-    if req.name:
-        x = x[x['Name'] == req.name]
-    if req.code:
-        x = x[x['Code'] == req.code]
-    if req.score_budget:
-        x = x[x['Budget-points'] <= req.score_budget]
-    if req.score_paid:
-        x = x[x['Paid-points'] <= req.score_paid]
-    if req.exams:
-        exams = req.exams.split(', ')
-        res = check_exams(x, 'Exams', exams)
-        x['Contains_all_exams'] = res
-        x = x[x['Contains_all_exams'] == True]
-    if req.sort_order and len(x) > 0:
-        if req.score_budget:
-            if req.sort_order == 'least points':
-                x = x.sort_values(by="Budget-points")
-            elif req.sort_order == 'most points':
-                x = x.sort_values(by="Budget-points", ascending=False)
-        elif req.score_paid:
-            if req.sort_order == 'least points':
-                x = x.sort_values(by='Paid-points')
-            elif req.sort_order == 'most points':
-                x = x.sort_values(by='Paid-points', ascending=False)
-        else:
-            pass
+def sort_table(req, index=None):
+    x = (catalogue.index if index is None else index).select(req)
     if x is None or len(x) == 0:
         return 'Не найдено подходящих вам学生们.'
     return 'Нашлись такие направления:\n' + '\n'.join(f'{z["Code"]} - {z["Name"]} '
@@ -96,29 +71,121 @@ def sort_table(req, table=tb):
                                                       f'{"".join(z["Courses"])}' for _, z in x.head(10).iterrows())
 
 
+class AgentReply(NamedTuple):
+    text: str
+    chunks: list
+    tool_results: list
+
+    @property
+    def context(self):
+        """Контекст ответа для журнала: процитированные фрагменты и результаты функций"""
+        return self.chunks + [str(x["content"]) for x in self.tool_results]
+
+
+class PreparedTrim(NamedTuple):
+    """Тред с сокращённой историей; source и count - локальная копия сообщений, по которой он собран"""
+    thread: object
+    messages: list
+    source: list
+    count: int
+
+
+def get_cited_chunks(res):
+    """Тексты фрагментов поискового индекса, на которые сослался ассистент в ответе"""
+    chunks = []
+    for citation in res.citations:
+        for source in citation.sources:
+            # Кроме фрагментов файлов в цитатах бывают источники неизвестного типа (UnknownSource)
+            # с текстом-заглушкой; класс FileChunk не экспортируется из SDK, поэтому сравнивается тип
+            if source.type != "filechunk":
+                continue
+            if source.text and source.text not in chunks:
+                chunks.append(source.text)
+    return chunks
+
+
+def wait_run(run, on_partial=None, events_start_idx=0):
+    """Результат запуска; с on_partial - с чтением частичных ответов из потока событий.
+
+    Возвращает результат и число прочитанных событий: после submit_tool_results поток
+    продолжается с того же места, а не повторяется с начала.
+    """
+    if on_partial is None:
+        return run.wait(), events_start_idx
+    for event in run.listen(events_start_idx=events_start_idx):
+        events_start_idx += 1
+        # Статусы StreamEvent сравниваются по имени: перечисление не экспортируется из SDK
+        if event.status.name == "PARTIAL_MESSAGE":
+            if event.text:
+                on_partial(event.text)
+        elif event.status.name in ("DONE", "TOOL_CALLS", "ERROR"):
+            break
+    # Цитаты есть только в итоговом результате запуска
+    return run.wait(), events_start_idx
+
+
 class Agent:
-    def __init__(self, sdk, model, assistant=None, instruction=None, search_index=None, tools=None):
+    def __init__(self, sdk, model, assistant=None, instruction=None, search_index=None, tools=None,
+                 answer_cache=None, pool=None):
 
         self.sdk = sdk
         self.model = model
         self.thread = None
         self.handover = False
+        self.answer_cache = answer_cache
+        if answer_cache is not None and search_index is not None:
+            answer_cache.ensure_index(search_index.id)
+
+        self.last_active = time.monotonic()
+        # Число запросов в текущем треде, по нему SessionManager решает, когда сокращать историю
+        self.turns = 0
+        # Локальная копия сообщений треда, чтобы не перечитывать тред из облака
+        self.messages = []
+
+        # Локальный индекс подключается как функция, облачный - как встроенный инструмент поиска
+        fn_tools = list(tools) if tools else []
+        index_tool = None
+        if isinstance(search_index, LocalSearchIndex):
+            fn_tools.append(make_search_tool(search_index))
+        elif search_index:
+            index_tool = search_index
+        self.tools = {x.__name__: x for x in fn_tools}
+
+        def factory():
+            sdk_tools = [sdk.tools.function(x) for x in fn_tools]
+            if index_tool:
+                sdk_tools.append(sdk.tools.search_index(index_tool))
+            created = create_assistant(sdk, model, sdk_tools)
+            if instruction:
+                created.update(instruction=instruction)
+            return created
 
+        self.pool = None
         if assistant:
             self.assistant = assistant
+        elif pool is not None:
+            self.pool = pool
+            self._pooled = lambda: pool.get(model, instruction, search_index, tools, factory)
+            self.assistant = self._pooled()
         else:
-            if tools:
-                self.tools = {x.__name__: x for x in tools}
-                tools = [sdk.tools.function(x) for x in tools]
-            else:
-                self.tools = {}
-                tools = []
-            if search_index:
-                tools.append(sdk.tools.search_index(search_index))
-            self.assistant = create_assistant(sdk, model, tools)
-
-            if instruction:
-                self.assistant.update(instruction=instruction)
+            self.assistant = factory()
+
+    def get_assistant(self):
+        """Ассистент для запуска; общий ассистент берётся из пула заново, чтобы пул мог его пересоздать"""
+        if self.pool is not None:
+            self.assistant = self._pooled()
+        return self.assistant
+
+    def start_run(self, thread):
+        """Запуск ассистента; если общий ассистент уже удалён в облаке, он пересоздаётся"""
+        assistant = self.get_assistant()
+        try:
+            return assistant.run(thread)
+        except Exception as e:
+            if self.pool is None or not is_not_found(e):
+                raise
+            self.pool.invalidate(assistant)
+            return self.get_assistant().run(thread)
 
     def get_thread(self, thread=None):
         if thread is not None:
@@ -130,13 +197,45 @@ class Agent:
     def get_handover(self):
         return self.handover
 
-    def __call__(self, message, thread=None):
+    def _remember(self, message, answer):
+        self.messages.append({"text": message, "role": "user"})
+        self.messages.append({"text": answer, "role": "assistant"})
+
+    def history(self):
+        """Сообщения текущего треда из локальной копии, от старых к новым"""
+        return list(self.messages)
+
+    @tracer.traced('agent.call')
+    def __call__(self, message, thread=None, on_partial=None):
+        """Ответ ассистента вместе с фрагментами базы знаний из цитат и результатами вызванных функций.
+
+        Если передан on_partial, ответ читается потоком через run.listen() и on_partial вызывается
+        с накопленным текстом по мере генерации.
+        """
+        self.last_active = time.monotonic()
         thread = self.get_thread(thread)
-        thread.write(message)
-        run = self.assistant.run(thread)
-        res = run.wait()
+        # Ответ на вопрос в продолжение диалога зависит от истории треда, общий кэш его не учитывает
+        followup = bool(self.messages)
+        if self.answer_cache is not None:
+            with tracer.span('agent.answer_cache'):
+                cached = self.answer_cache.get(message, followup)
+            if cached is not None:
+                # История треда должна содержать и вопрос, и ответ, как после обычного запуска
+                with tracer.span('agent.thread_write'):
+                    thread.write(message)
+                    thread.write({"text": cached.text, "role": "assistant"})
+                if on_partial is not None:
+                    on_partial(cached.text)
+                self.turns += 1
+                self._remember(message, cached.text)
+                return cached
+        with tracer.span('agent.thread_write'):
+            thread.write(message)
+        with tracer.span('agent.run'):
+            run = self.start_run(thread)
+            res, events = wait_run(run, on_partial)
+        result = []
         if res.tool_calls:
-            result = []
             for f in res.tool_calls:
                 print(
                     f" + Вызываем функцию {f.function.name}, args={f.function.arguments}"
@@ -144,12 +243,59 @@ class Agent:
                 fn = self.tools[f.function.name]
                 if f.function.name == 'HandOver':
                     self.handover = True
-                obj = fn(**f.function.arguments)
-                x = obj.process(thread)
+                with tracer.span(f'tool.{f.function.name}'):
+                    obj = fn(**f.function.arguments)
+                    x = obj.process(thread)
                 result.append({"name": f.function.name, "content": x})
-            run.submit_tool_results(result)
-            res = run.wait()
-        return res.text
+            with tracer.span('agent.run_after_tools'):
+                run.submit_tool_results(result)
+                res, _ = wait_run(run, on_partial, events)
+        with tracer.span('agent.citations'):
+            context = get_cited_chunks(res)
+        reply = AgentReply(res.text, context, result)
+        self.turns += 1
+        self._remember(message, res.text)
+        if self.answer_cache is not None and not any(x["name"] in STATEFUL_TOOLS for x in result):
+            self.answer_cache.put(message, reply, followup)
+        return reply
+
+    def prepare_trim(self, keep_messages, summarize=None):
+        """Новый тред с последними keep_messages сообщениями, чтобы ассистент не перечитывал всю историю.
+
+        summarize(messages) -> str, если передан, сжимает более ранние сообщения в краткое содержание.
+        Тред создаётся и заполняется без изменения агента (можно вызывать в фоне), подставляет его apply_trim.
+        """
+        if self.thread is None:
+            return None
+        source = self.messages
+        messages = list(source)
+        recent = messages[len(messages) - keep_messages:] if keep_messages else []
+        older = messages[:len(messages) - len(recent)]
+        thread = create_thread(self.sdk)
+        kept = []
+        if summarize and older:
+            kept.append({"text": f"Краткое содержание начала диалога: {summarize(older)}", "role": "assistant"})
+        kept.extend(recent)
+        for msg in kept:
+            thread.write(msg)
+        return PreparedTrim(thread, kept, source, len(messages))
+
+    def apply_trim(self, prepared):
+        """Подстановка подготовленного треда; возвращает прежний тред (его удаление можно отложить)
+        или None, если с момента подготовки в треде появились новые сообщения и подготовленный устарел
+        """
+        if prepared.source is not self.messages or prepared.count != len(self.messages):
+            return None
+        old = self.thread
+        self.thread = prepared.thread
+        self.messages = prepared.messages
+        self.turns = 0
+        return old
+
+    def trim_history(self, keep_messages, summarize=None):
+        """Сокращение истории сразу: prepare_trim и apply_trim; возвращает прежний тред"""
+        prepared = self.prepare_trim(keep_messages, summarize)
+        return self.apply_trim(prepared) if prepared is not None else None
 
     def restart(self):
         if self.thread:
@@ -157,27 +303,24 @@ class Agent:
             self.thread = self.sdk.threads.create(
                 name="Test", ttl_days=1, expiration_policy="static"
             )
+        self.messages = []
 
     def done(self, delete_assistant=False):
+        """Удаление треда; delete_assistant удаляет и ассистента.
+
+        Общий ассистент сначала исключается из пула: новые сессии получат другой, а уже
+        работающие с ним пересоздадут его при первом запуске (см. start_run).
+        """
         if self.thread:
             self.thread.delete()
+            self.thread = None
+        self.messages = []
         if delete_assistant:
+            if self.pool is not None:
+                self.pool.invalidate(self.assistant)
             self.assistant.delete()
 
 
-def check_exams(df: pd.DataFrame, column_name: str, exams):
-    results = []
-
-    for cell in df[column_name]:
-        expr = [1 for exam in exams if exam.lower() in cell.lower()]
-        if len(expr) >= 3:
-            results.append(True)
-        else:
-            results.append(False)
-
-    return results
-
-
 class HandOver(BaseModel):
     """Эта функция предназначена для перевода твеого диалога с пользователем на диалог с человеком-оператором"""
 
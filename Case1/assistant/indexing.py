@@ -5,7 +5,11 @@
 from glob import glob
 from pathlib import Path
 from dotenv import load_dotenv
-from assistant import sdk
+from assistant.assistant import sdk
+from assistant.uploads import UploadManifest, upload_chunks, iter_uploads, chunk_key
+from assistant.chunk_store import ChunkStore
+from assistant.tokens import TokenCache, TokenEstimator, count_tokens
+from assistant.chunking import CHUNK_TOKENS, DATA_DIR, get_files, chunk_file
 import pandas as pd
 from yandex_cloud_ml_sdk.search_indexes import (
     StaticIndexChunkingStrategy,
@@ -13,25 +17,50 @@ from yandex_cloud_ml_sdk.search_indexes import (
     ReciprocalRankFusionIndexCombinationStrategy,
 )
 import os
+import time
+import argparse
+import threading
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from dotenv import set_key
 from yandex_cloud_ml_sdk import YCloudML
 
 # Инициализация SDK для токенизации
 model = sdk.models.completions("yandexgpt", model_version="rc")
 
-# Оптимальный размер чанка (1000 токенов)
-CHUNK_SIZE = 1000 * 2  # 1000 токенов * 2 символа/токен
+# Кэш подсчёта токенов, чтобы повторный анализ не тратил квоту токенизатора
+TOKEN_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cache", "token_counts.json")
+token_cache = TokenCache(TOKEN_CACHE_PATH)
 
+# Манифест завершённых загрузок для продолжения прерванного запуска
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cache", "upload_manifest.jsonl")
+# Состояние индекса для инкрементальной переиндексации
+CHUNK_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cache", "chunk_store.json")
+# Доля устаревших файлов в индексе, после которой индекс пересобирается целиком.
+# API индекса не удаляет отдельные файлы, поэтому при 0 любой пропавший из корпуса чанк
+# сразу приводит к пересборке и в поиск не попадает
+STALE_THRESHOLD = 0.0
+# Число одновременно выполняющихся операций добавления пакетов в индекс
+MAX_IN_FLIGHT = 3
 
-def get_token_count(filename):
-    """Подсчёт количества токенов в файле"""
+
+def get_token_count(filename, offline=False, estimator=None):
+    """Подсчёт количества токенов в файле (с кэшем, offline - без удалённого токенизатора)"""
     with open(filename, "r", encoding="utf8") as f:
         content = f.read()
-        tokens = len(model.tokenize(content))
-        chars = len(content)
-        ratio = chars / tokens
-        print(f"{os.path.basename(filename)}: {tokens} токенов, {ratio:.2f} chars/token")
-        return tokens
+    category = os.path.basename(os.path.dirname(filename))
+    tokens = count_tokens(content, token_cache, model=None if offline else model,
+                          category=category, estimator=estimator)
+    chars = len(content)
+    ratio = chars / tokens if tokens else 0
+    print(f"{os.path.basename(filename)}: {tokens} токенов, {ratio:.2f} chars/token")
+    return tokens
+
+
+def get_chunk_size(category=None, max_tokens=CHUNK_TOKENS, estimator=None):
+    """Размер чанка в символах по соотношению символов и токенов для категории (им режет chunk_file)"""
+    estimator = estimator or TokenEstimator.fit(token_cache)
+    return estimator.chunk_size(max_tokens, category)
 
 
 def get_file_len(filename):
@@ -41,181 +70,80 @@ def get_file_len(filename):
     return l
 
 
-def chunk_and_upload_file(filename):
-    """Разбиение файла на чанки и загрузка в облако"""
-    with open(filename, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    # Определяем тип файла по пути
-    if "facts" in filename:
-        return chunk_and_upload_facts(content)
-    elif "docs" in filename:
-        return chunk_and_upload_docs(content)
-    else:
-        return chunk_and_upload_chats(content)
-
-
-def chunk_and_upload_facts(content):
-    """Разбиение файла с фактами на чанки и загрузка в облако"""
-    chunks = []
-
-    # Пропускаем заголовок
-    lines = content.split("\n")
-    if lines[0].startswith("#"):
-        lines = lines[1:]
-
-    # Пропускаем заголовок таблицы и разделитель
-    if lines[0].startswith("|"):
-        lines = lines[2:]
-
-    # Обрабатываем каждую строку таблицы
-    for line in lines:
-        if not line.strip() or not line.startswith("|"):
-            continue
-
-        # Разделяем строку на ячейки
-        cells = [cell.strip() for cell in line.split("|")[1:-1]]
-
-        # Создаем чанк для каждой непустой ячейки
-        for i, cell in enumerate(cells):
-            if not cell:
-                continue
-
-            # Определяем категорию по позиции
-            categories = ["Учебный процесс", "Инфраструктура", "Студенческая жизнь",
-                          "История и уникальность", "Международные возможности"]
-            category = categories[i] if i < len(categories) else "Другое"
-
-            # Форматируем факт
-            fact = f"""Категория: {category}
-Факт: {cell}"""
-
-            # Загружаем чанк
-            chunk_id = sdk.files.upload_bytes(
-                fact.encode(),
-                ttl_days=1,
-                expiration_policy="static",
-                mime_type="text/markdown"
-            )
-            chunks.append(chunk_id)
-
-    return chunks
-
-
-def chunk_and_upload_docs(content):
-    """Разбиение файла с документами на чанки и загрузка в облако"""
-    chunks = []
-
-    # Пропускаем заголовок
-    lines = content.split("\n")
-    if lines[0].startswith("#"):
-        lines = lines[1:]
-
-    # Пропускаем заголовок таблицы и разделитель
-    if lines[0].startswith("|"):
-        lines = lines[2:]
-
-    # Обрабатываем каждую строку таблицы
-    for line in lines:
-        if not line.strip() or not line.startswith("|"):
-            continue
-
-        # Разделяем строку на ячейки
-        cells = [cell.strip() for cell in line.split("|")[1:-1]]
-        if len(cells) >= 3:
-            keywords = cells[0].strip()
-            question = cells[1].strip()
-            answer = cells[2].strip()
-
-            # Форматируем документ
-            doc = f"""Ключевые слова: {keywords}
-Вопрос: {question}
-Ответ: {answer}"""
-
-            # Загружаем чанк
-            chunk_id = sdk.files.upload_bytes(
-                doc.encode(),
-                ttl_days=1,
-                expiration_policy="static",
-                mime_type="text/markdown"
-            )
-            chunks.append(chunk_id)
-
-    return chunks
-
-
-def chunk_and_upload_chats(content):
-    """Разбиение файла с чатами на чанки и загрузка в облако"""
-    # Пропускаем заголовок и начало таблицы
-    lines = content.split("\n")
-    if lines[0].startswith("#"):
-        year = lines[0].strip("#").strip()
-        lines = lines[1:]
-    else:
-        year = "unknown"
-
-    if lines[0].startswith("| Вопросы | Ответы |"):
-        lines = lines[2:]  # Пропускаем заголовок таблицы и разделитель
-
-    # Разбиваем на диалоги
-    chunks = []
-
-    for line in lines:
-        if not line.strip():  # Пропускаем пустые строки
-            continue
-
-        # Разделяем строку на вопрос и ответ
-        parts = line.split("|")
-        if len(parts) < 4:  # Пропускаем некорректные строки
-            continue
-
-        # Извлекаем ID и дату из вопроса
-        question_parts = parts[1].strip().split("<br>")
-        if len(question_parts) > 1:
-            metadata = question_parts[0].strip()
-            question = question_parts[1].strip()
-        else:
-            metadata = ""
-            question = parts[1].strip()
-
-        # Извлекаем ID и дату из ответа
-        answer_parts = parts[2].strip().split("<br>")
-        if len(answer_parts) > 1:
-            answer_metadata = answer_parts[0].strip()
-            answer = answer_parts[1].strip()
-        else:
-            answer_metadata = ""
-            answer = parts[2].strip()
-
-        # Форматируем диалог с метаданными
-        dialog = f"""Год: {year}
-Вопрос ({metadata}):
-{question}
-
-Ответ ({answer_metadata}):
-{answer}"""
-
-        # Загружаем каждый диалог как отдельный чанк
-        chunk_id = sdk.files.upload_bytes(
-            dialog.encode(),
-            ttl_days=1,
-            expiration_policy="static",
-            mime_type="text/markdown"
-        )
-        chunks.append(chunk_id)
-
-    return chunks
-
-
-def create_and_populate_search_index(chunks, index_name, batch_size=100):
-    """Создание поискового индекса и добавление чанков пакетами"""
-    if not chunks:
+def chunk_and_upload_file(filename, manifest=None):
+    """Разбиение файла на чанки и параллельная загрузка в облако"""
+    return upload_chunks(sdk, chunk_file(filename, TokenEstimator.fit(token_cache)), manifest=manifest)
+
+
+def iter_batches(items, batch_size):
+    """Разбиение итератора на пакеты по мере поступления элементов"""
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def wait_batch(op, batch_no, batch_len, started):
+    """Ожидание отложенной операции и замер времени пакета"""
+    op.wait()
+    elapsed = time.monotonic() - started
+    print(f"Пакет {batch_no} добавлен ({batch_len} чанков, {elapsed:.1f} с)")
+    return {"batch": batch_no, "chunks": batch_len, "seconds": elapsed}
+
+
+def populate_search_index(index, batches, max_in_flight=MAX_IN_FLIGHT, first_batch_no=1, on_batch=None):
+    """Добавление пакетов в индекс, одновременно выполняется до max_in_flight отложенных операций"""
+    timings = []
+    with ThreadPoolExecutor(max_workers=max_in_flight) as waiters:
+        in_flight = set()
+        for batch_no, batch in enumerate(batches, first_batch_no):
+            if len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                timings.extend(f.result() for f in finished)
+            print(f"Добавление пакета {batch_no} ({len(batch)} чанков)...")
+            op = index.add_files_deferred(batch)
+            future = waiters.submit(wait_batch, op, batch_no, len(batch), time.monotonic())
+            if on_batch:
+                def done(f, batch=batch):
+                    if f.exception() is None:
+                        on_batch(batch)
+                future.add_done_callback(done)
+            in_flight.add(future)
+        finished, _ = wait(in_flight)
+        timings.extend(f.result() for f in finished)
+    return sorted(timings, key=lambda t: t["batch"])
+
+
+def print_batch_report(timings, total_seconds):
+    """Сводка по времени пакетов для подбора batch_size"""
+    if not timings:
+        return
+    seconds = [t["seconds"] for t in timings]
+    chunks = sum(t["chunks"] for t in timings)
+    print(f"\nПакетов: {len(timings)}, чанков: {chunks}, общее время: {total_seconds:.1f} с")
+    print(f"Время пакета: мин {min(seconds):.1f} с, среднее {sum(seconds) / len(seconds):.1f} с, "
+          f"макс {max(seconds):.1f} с")
+    print(f"Пропускная способность: {chunks / total_seconds:.1f} чанков/с")
+
+
+def create_and_populate_search_index(chunks, index_name, batch_size=100, max_in_flight=MAX_IN_FLIGHT,
+                                     on_batch=None):
+    """Создание поискового индекса и добавление чанков пакетами.
+
+    chunks может быть итератором (например, iter_uploads): пакеты отправляются,
+    как только набирается batch_size загруженных файлов, не дожидаясь остальных загрузок.
+    """
+    batches = iter_batches(chunks, batch_size)
+    initial_batch = next(batches, None)
+    if not initial_batch:
         raise ValueError("No chunks provided for indexing")
 
     print(f"\nСоздание поискового индекса...")
+    started = time.monotonic()
 
     # Создаем индекс с первым пакетом чанков (до batch_size)
-    initial_batch = chunks[:batch_size]
     op = sdk.search_indexes.create_deferred(
         initial_batch,
         index_type=HybridSearchIndexType(
@@ -227,58 +155,87 @@ def create_and_populate_search_index(chunks, index_name, batch_size=100):
         ),
     )
     index = op.wait()
+    timings = [{"batch": 1, "chunks": len(initial_batch), "seconds": time.monotonic() - started}]
     print(f"Индекс {index_name} создан с первым пакетом ({len(initial_batch)} чанков)!")
+    if on_batch:
+        on_batch(initial_batch)
 
     # Добавляем оставшиеся чанки пакетами
-    for i in range(batch_size, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
-        print(f"Добавление пакета {(i // batch_size) + 1} ({len(batch)} чанков)...")
-        op = index.add_files_deferred(batch)
-        op.wait()
-        print(f"Пакет {(i // batch_size) + 1} добавлен!")
+    timings += populate_search_index(index, batches, max_in_flight, first_batch_no=2, on_batch=on_batch)
 
     print(f"Индекс {index_name} полностью заполнен!")
+    print_batch_report(timings, time.monotonic() - started)
     return index
 
 
-def get_files():
-    """Получение списка всех файлов для анализа"""
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-    data_dir = os.path.join(project_root, "data")
-
-    files = []
-    # Добавляем файлы из директории chats
-    for fn in glob(os.path.join(data_dir, "chats", "*.md")):
-        if os.path.isfile(fn):
-            files.append(fn)
-    # Добавляем файлы из директории facts
-    for fn in glob(os.path.join(data_dir, "facts", "*.md")):
-        if os.path.isfile(fn):
-            files.append(fn)
-    # Добавляем файлы из директории docs
-    for fn in glob(os.path.join(data_dir, "docs", "*.md")):
-        if os.path.isfile(fn):
-            files.append(fn)
-    return sorted(files)
-
-
-def analyze_files():
-    """Анализ всех .md файлов в директориях data/chats и data/facts"""
-    # Получаем путь к корню проекта
-    project_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-    data_dir = os.path.join(project_root, "2025-mai-yandexcloud-kant_shar", "knowledge_base", "data")
+def update_search_index(chunks, store, manifest=None, index_name="index_1", batch_size=100,
+                        max_in_flight=MAX_IN_FLIGHT, stale_threshold=STALE_THRESHOLD, rebuild=False):
+    """Инкрементальное обновление индекса: загружаются и добавляются только новые чанки.
+
+    Пропавшие из корпуса чанки помечаются устаревшими; когда их доля превышает
+    stale_threshold (по умолчанию - при любом удалении), индекс пересобирается заново.
+    При пересборке файлы берутся из манифеста, пока не истёк их срок хранения,
+    остальные чанки загружаются повторно.
+    """
+    texts = dict((chunk_key(text), text) for text in chunks)
+    keys = list(texts)
+    added, removed = store.diff(keys)
+
+    if not rebuild and store.index_id and store.stale_ratio(removed) > stale_threshold:
+        print(f"Доля устаревших чанков превышает {stale_threshold:.0%}, индекс будет пересобран")
+        rebuild = True
+
+    # Ключи загруженных файлов, чтобы по завершении пакета отметить его в хранилище
+    uploaded = {}
+
+    def stream(texts_to_upload):
+        for key, file_id in iter_uploads(sdk, texts_to_upload, manifest=manifest):
+            uploaded[file_id] = key
+            yield file_id
+
+    if rebuild or not store.index_id:
+        index = create_and_populate_search_index(stream(texts.values()), index_name, batch_size, max_in_flight)
+        store.reset(index.id, list(uploaded.values()), list(uploaded))
+        store.save()
+        return index
+
+    index = sdk.search_indexes.get(store.index_id)
+    print(f"\nНовых чанков: {len(added)}, удалённых: {len(removed)}")
+    if added:
+        lock = threading.Lock()
+
+        def on_batch(batch):
+            with lock:
+                store.add([uploaded[file_id] for file_id in batch], batch)
+                store.save()
+
+        started = time.monotonic()
+        timings = populate_search_index(index, iter_batches(stream(texts[key] for key in added), batch_size),
+                                        max_in_flight, on_batch=on_batch)
+        print_batch_report(timings, time.monotonic() - started)
+    if removed:
+        store.remove(removed)
+        store.save()
+    if not added and not removed:
+        print("Индекс актуален, изменений нет")
+    return index
+
 
+def analyze_files(offline=False):
+    """Анализ всех .md файлов в директориях data/chats и data/facts"""
     print("\nАнализ соотношения токенов и символов:")
+    estimator = TokenEstimator.fit(token_cache) if offline else None
     d = [
         {
             "File": fn,
-            "Tokens": get_token_count(fn),
+            "Tokens": get_token_count(fn, offline, estimator),
             "Chars": get_file_len(fn),
             "Category": os.path.basename(os.path.dirname(fn)),
         }
-        for fn in glob(os.path.join(data_dir, "*", "*.md"))
+        for fn in glob(os.path.join(DATA_DIR, "*", "*.md"))
         if os.path.isfile(fn)
     ]
+    token_cache.save()
     return pd.DataFrame(d)
 
 
@@ -324,33 +281,49 @@ def initialize_sdk():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Чанкование базы знаний и обновление поискового индекса")
+    parser.add_argument("--rebuild", action="store_true", help="пересобрать индекс целиком")
+    parser.add_argument("--batch-size", type=int, default=100, help="размер пакета файлов")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help="число одновременных операций добавления пакетов")
+    parser.add_argument("--offline-tokens", action="store_true",
+                        help="не вызывать токенизатор, оценивать токены по кэшу замеров")
+    args = parser.parse_args()
+
     # Вывод списка файлов
     print("\nСписок файлов для обработки:")
     for file in get_files():
         print(f"- {file}")
 
     # Анализ файлов
-    df = analyze_files()
+    df = analyze_files(offline=args.offline_tokens)
     if df.empty:
         print("\nФайлы не найдены. Проверьте пути к директориям data/chats и data/facts.")
     else:
         print("\nРезультаты анализа файлов:")
         print(df)
         print(df.groupby("Category").agg({"Tokens": ("min", "mean", "max")}))
-
-        # Загрузка файлов в облако с чанкованием
-        print("\nЗагрузка файлов в облако с чанкованием...")
-        df["Uploaded"] = df["File"].apply(chunk_and_upload_file)
-        print("\nЗагруженные чанки:")
+        # Чанкование файлов по замеренному соотношению символов и токенов: диалоги из чатов упаковываются
+        # в чанки до CHUNK_TOKENS токенов, более длинные факты и документы режутся
+        estimator = TokenEstimator.fit(token_cache)
+        print(f"\nРазмер чанка на {CHUNK_TOKENS} токенов по категориям:")
+        for category in sorted(df["Category"].unique()):
+            print(f"- {category}: {get_chunk_size(category, estimator=estimator)} символов")
+        df["Chunks"] = df["File"].apply(lambda filename: chunk_file(filename, estimator))
+        print("\nЧанки:")
         for _, row in df.iterrows():
-            print(f"- {row['File']} -> {len(row['Uploaded'])} чанков")
-        print("Файлы загружены!")
+            print(f"- {row['File']} -> {len(row['Chunks'])} чанков")
 
-        # Создание и заполнение индекса
-        all_chunks = df["Uploaded"].explode().tolist()
-        index = create_and_populate_search_index(all_chunks, f"index_1")
+        # Загрузка изменившихся чанков и обновление индекса
+        manifest = UploadManifest(MANIFEST_PATH)
+        store = ChunkStore(CHUNK_STORE_PATH)
+        previous_index_id = store.index_id
+        all_chunks = df["Chunks"].explode().dropna().tolist()
+        index = update_search_index(all_chunks, store, manifest, batch_size=args.batch_size,
+                                    max_in_flight=args.in_flight, rebuild=args.rebuild)
 
         # Сохранение ID индекса в .env
-        env_file = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), ".env")
-        set_key(env_file, "SEARCH_INDEX_ID", index.id)
-        print("\nID индекса сохранён в .env")
\ No newline at end of file
+        if index.id != previous_index_id:
+            env_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")
+            set_key(env_file, "SEARCH_INDEX_ID", index.id)
+            print("\nID индекса сохранён в .env")
@@ -0,0 +1,244 @@
+"""
+Локальный гибридный поиск по базе знаний: BM25 + плотные эмбеддинги, объединённые через RRF.
+
+Используется вместо облачного поискового индекса для офлайн-замеров и локальной работы бота.
+Сборка индекса из директории data и проверка запроса (из директории Case1):
+
+    python -m assistant.local_search --build
+    python -m assistant.local_search --query "Какие документы нужны для поступления?"
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+from typing import NamedTuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+
+from assistant.chunking import DATA_DIR, get_files, chunk_file
+
+LOCAL_INDEX_DIR = os.path.join(DATA_DIR, "cache", "local_index")
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# Константа k в формуле RRF, как в ReciprocalRankFusionIndexCombinationStrategy
+RRF_K = 60
+# Сколько кандидатов берётся из каждого индекса перед объединением
+CANDIDATES = 50
+
+WORD_PATTERN = re.compile(r"[а-яёa-z0-9]+")
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее её мне было вот
+от меня еще ещё нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять
+уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+почти мой тем чтобы нее неё сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед
+иногда лучше чуть том нельзя такой им более всегда конечно всю между это какие какое каких каким какую
+здравствуйте подскажите пожалуйста
+""".split())
+# Окончания русских слов для лёгкого стемминга, от длинных к коротким
+ENDINGS = """
+ившись ывшись
+вшись
+ивши ывши иями ость ейте уйте
+вши ими ыми его ого ему ому ями ами ией ием иях ост ите или ыли ила ыла ена ило ыло ено ует уют ить
+ыть ишь ать ять еть уть ешь нно ете йте
+ях ее ие ые ое ей ий ый ой ем им ым ом их ых ую юю ая яя ою ею ла на ли ло но ет ют ны ть ил ыл ен
+ят ит ыт ев ов ье еи ии ям ам ах ию ью ия ья ся сь
+а е и й о у ы ь ю я
+""".split()
+MIN_STEM = 3
+
+
+def stem(word):
+    """Отбрасывание самого длинного окончания, если остаётся основа не короче MIN_STEM"""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Токены для BM25: слова в нижнем регистре без стоп-слов, приведённые к основе"""
+    words = WORD_PATTERN.findall(text.lower().replace("ё", "е"))
+    return [stem(word) for word in words if word not in STOPWORDS]
+
+
+class SearchResult(NamedTuple):
+    content: str
+    score: float
+    chunk: int
+
+
+class SearchResults(NamedTuple):
+    results: list
+
+
+class BM25Index:
+    """Инвертированный индекс с ранжированием Okapi BM25"""
+
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = []
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((doc, tf))
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def search(self, query, top_k=CANDIDATES):
+        n = len(self.lengths)
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc] / self.avg_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+class SentenceTransformerEmbedder:
+    """Эмбеддинги sentence-transformers, модель загружается при первом обращении"""
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        self.model_name = model_name
+        self._model = None
+
+    def __call__(self, texts):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return np.asarray(self._model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+
+class DenseIndex:
+    """Косинусная близость по нормированным эмбеддингам"""
+
+    def __init__(self, embedder, vectors):
+        self.embedder = embedder
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, embedder, texts):
+        return cls(embedder, embedder(texts))
+
+    def search(self, query, top_k=CANDIDATES):
+        scores = self.vectors @ self.embedder([query])[0]
+        top = np.argsort(-scores)[:top_k]
+        return [(int(doc), float(scores[doc])) for doc in top]
+
+
+def rrf_fuse(rankings, k=RRF_K):
+    """Reciprocal rank fusion: сумма 1 / (k + ранг) по всем ранжированиям"""
+    scores = {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, 1):
+            scores[doc] = scores.get(doc, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LocalSearchIndex:
+    """Гибридный индекс по чанкам того же формата, что загружает indexing.py.
+
+    Без embedder работает только BM25. Метод search возвращает объект с полем results,
+    элементы которого содержат content, как у облачного поискового индекса.
+    """
+
+    id = "local"
+
+    def __init__(self, chunks, embedder=None, vectors=None):
+        self.chunks = list(chunks)
+        self.bm25 = BM25Index(self.chunks)
+        self.dense = None
+        if embedder is not None:
+            self.dense = DenseIndex(embedder, vectors) if vectors is not None else DenseIndex.build(embedder, self.chunks)
+
+    @classmethod
+    def from_files(cls, files=None, embedder=None):
+        chunks = []
+        for filename in files or get_files():
+            chunks.extend(chunk_file(filename))
+        return cls(chunks, embedder)
+
+    def search(self, query, top_k=5):
+        rankings = [self.bm25.search(query)]
+        if self.dense is not None:
+            rankings.append(self.dense.search(query))
+        fused = rrf_fuse(rankings) if len(rankings) > 1 else rankings[0]
+        return SearchResults([SearchResult(self.chunks[doc], score, doc) for doc, score in fused[:top_k]])
+
+    def save(self, path=LOCAL_INDEX_DIR):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump(self.chunks, f, ensure_ascii=False)
+        if self.dense is not None:
+            np.save(os.path.join(path, "vectors.npy"), self.dense.vectors)
+
+    @classmethod
+    def load(cls, path=LOCAL_INDEX_DIR, embedder=None):
+        """Загрузка сохранённого индекса; BM25 пересобирается, эмбеддинги чанков читаются с диска"""
+        with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        vectors_path = os.path.join(path, "vectors.npy")
+        if not os.path.exists(vectors_path):
+            return cls(chunks)
+        return cls(chunks, embedder or SentenceTransformerEmbedder(), np.load(vectors_path))
+
+
+def format_results(results):
+    if not results.results:
+        return "В базе знаний ничего не найдено."
+    return "\n\n---\n\n".join(result.content for result in results.results)
+
+
+def make_search_tool(index, top_k=5):
+    """Функция для ассистента, выполняющая поиск по локальному индексу"""
+
+    class SearchKnowledgeBase(BaseModel):
+        """Поиск по базе знаний приёмной комиссии МАИ: правила приёма, документы, факты об институте
+        и ответы приёмной комиссии прошлых лет. Вызывай эту функцию перед ответом на любой вопрос
+        о поступлении или об институте."""
+
+        query: str = Field(description='Поисковый запрос на русском языке')
+
+        def process(self, thread):
+            return format_results(index.search(self.query, top_k))
+
+    return SearchKnowledgeBase
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный гибридный поисковый индекс")
+    parser.add_argument("--build", action="store_true", help="собрать индекс из data и сохранить")
+    parser.add_argument("--bm25-only", action="store_true", help="без плотных эмбеддингов")
+    parser.add_argument("--query", help="поисковый запрос для проверки")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    embedder = None if args.bm25_only else SentenceTransformerEmbedder()
+    if args.build:
+        started = time.perf_counter()
+        index = LocalSearchIndex.from_files(embedder=embedder)
+        index.save()
+        print(f"Индекс из {len(index.chunks)} чанков собран за {time.perf_counter() - started:.1f} с")
+    else:
+        index = LocalSearchIndex.load(embedder=embedder)
+        if args.bm25_only:
+            index.dense = None
+
+    if args.query:
+        started = time.perf_counter()
+        results = index.search(args.query, args.top_k)
+        print(f"Поиск занял {(time.perf_counter() - started) * 1000:.1f} мс\n")
+        for result in results.results:
+            print(f"[{result.score:.4f}] {result.content[:200]}\n")
@@ -0,0 +1,175 @@
+"""
+Потоковый разбор markdown-таблиц базы знаний (факты, документы, чаты)
+"""
+
+import re
+from typing import NamedTuple
+
+MESSAGE_ID_PATTERN = re.compile(r"^\*\*ID\s*(\d+)\*\*")
+SEPARATOR_CELL_PATTERN = re.compile(r"^:?-+:?$")
+YEAR_PATTERN = re.compile(r"\d{4}")
+
+
+class TableLine(NamedTuple):
+    """Элемент разметки: kind - text, header, separator или row"""
+    kind: str
+    cells: list
+    raw: str
+    heading: str
+    line_no: int
+
+
+class FactRow(NamedTuple):
+    category: str
+    fact: str
+
+
+class DocRow(NamedTuple):
+    keywords: str
+    question: str
+    answer: str
+
+
+class ChatMessage(NamedTuple):
+    id: str
+    meta: str
+    text: str
+
+
+class ChatRow(NamedTuple):
+    year: str
+    question: list
+    answer: list
+    line_no: int
+
+
+def split_cells(line):
+    """Разбиение строки таблицы на ячейки с учётом экранированных \\|"""
+    if "\\" not in line:
+        return [cell.strip() for cell in line.strip().split("|")[1:-1]]
+    cells = []
+    current = []
+    chars = iter(line.strip())
+    for ch in chars:
+        if ch == "\\":
+            nxt = next(chars, "")
+            current.append("|" if nxt == "|" else ch + nxt)
+        elif ch == "|":
+            cells.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    cells.append("".join(current))
+    # Ведущая и замыкающая | дают пустые крайние ячейки
+    return [cell.strip() for cell in cells[1:-1]]
+
+
+def _row_is_closed(text):
+    text = text.rstrip()
+    return text.endswith("|") and not text.endswith("\\|")
+
+
+def iter_table_lines(lines):
+    """Однопроходный разбор потока строк в элементы TableLine.
+
+    Строка таблицы, не закрытая символом |, продолжается на следующих строках
+    (многострочные ячейки), продолжения объединяются через перевод строки.
+    """
+    heading = ""
+    in_table = False
+    pending = None
+    pending_no = 0
+    for line_no, line in enumerate(lines, 1):
+        if pending is not None:
+            pending.append(line)
+            if not _row_is_closed(line):
+                continue
+            raw = "".join(pending)
+            pending = None
+            cells = split_cells(raw.replace("\r", ""))
+            yield TableLine("row" if in_table else "header", cells, raw, heading, pending_no)
+            in_table = True
+            continue
+
+        stripped = line.strip()
+        if not stripped.startswith("|"):
+            in_table = False
+            if stripped.startswith("#"):
+                heading = stripped.lstrip("#").strip()
+            yield TableLine("text", [], line, heading, line_no)
+            continue
+
+        if not _row_is_closed(line):
+            pending = [line]
+            pending_no = line_no
+            continue
+
+        cells = split_cells(line)
+        if in_table and cells and all(SEPARATOR_CELL_PATTERN.match(cell) for cell in cells):
+            yield TableLine("separator", cells, line, heading, line_no)
+        elif in_table:
+            yield TableLine("row", cells, line, heading, line_no)
+        else:
+            in_table = True
+            yield TableLine("header", cells, line, heading, line_no)
+
+    if pending is not None:
+        # Файл оборвался внутри строки таблицы
+        raw = "".join(pending)
+        yield TableLine("row" if in_table else "header", split_cells(raw.rstrip() + "|"), raw, heading, pending_no)
+
+
+def iter_rows(lines):
+    """Пары (заголовок таблицы, ячейки строки) для всех строк данных"""
+    header = []
+    for item in iter_table_lines(lines):
+        if item.kind == "header":
+            header = item.cells
+        elif item.kind == "row":
+            yield header, item
+
+
+def iter_facts(lines):
+    """Факты: каждая непустая ячейка, категория - заголовок её столбца"""
+    for header, row in iter_rows(lines):
+        for i, cell in enumerate(row.cells):
+            if cell:
+                yield FactRow(header[i] if i < len(header) else "Другое", cell)
+
+
+def iter_docs(lines):
+    """Документы: ключевые слова, вопрос и ответ"""
+    for _, row in iter_rows(lines):
+        if len(row.cells) >= 3:
+            yield DocRow(*row.cells[:3])
+
+
+def _br_to_newlines(text):
+    return text.replace("<br>", "\n").strip()
+
+
+def parse_messages(cell):
+    """Разбор ячейки чата на сообщения вида **ID n** (автор, дата)<br>текст"""
+    messages = []
+    for part in cell.replace("\n", "<br>").split("<br><br>"):
+        meta, _, text = part.partition("<br>")
+        match = MESSAGE_ID_PATTERN.match(meta.strip())
+        if match:
+            messages.append(ChatMessage(match.group(1), meta.strip(), _br_to_newlines(text)))
+        elif messages:
+            # Абзац того же сообщения, отделённый пустой строкой
+            last = messages[-1]
+            messages[-1] = last._replace(text=f"{last.text}\n\n{_br_to_newlines(part)}")
+        else:
+            messages.append(ChatMessage(None, "", _br_to_newlines(part)))
+    return messages
+
+
+def iter_chats(lines):
+    """Диалоги из чатов: год берётся из заголовка файла"""
+    for _, row in iter_rows(lines):
+        if len(row.cells) < 2:
+            continue
+        match = YEAR_PATTERN.search(row.heading)
+        year = match.group(0) if match else (row.heading or "unknown")
+        yield ChatRow(year, parse_messages(row.cells[0]), parse_messages(row.cells[1]), row.line_no)
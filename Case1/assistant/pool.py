@@ -0,0 +1,78 @@
+"""
+Пул облачных ассистентов: один ассистент на конфигурацию, общий для всех пользователей
+"""
+
+import threading
+import time
+
+# Ассистенты создаются с ttl_days=1 и expiration_policy="since_last_active" (assistant/funcs.py)
+ASSISTANT_TTL_SECONDS = 24 * 60 * 60
+# Запас до истечения: ассистент пересоздаётся заранее, а не после ошибки запуска
+TTL_MARGIN_SECONDS = 60 * 60
+
+
+def is_not_found(error):
+    """Ошибка gRPC NOT_FOUND: ассистент уже удалён в облаке (например, истёк его срок жизни)"""
+    code = getattr(error, "code", None)
+    return callable(code) and getattr(code(), "name", None) == "NOT_FOUND"
+
+
+def pool_key(model, instruction=None, search_index=None, tools=None):
+    """Конфигурация ассистента: модель, инструкция, функции и поисковый индекс"""
+    return (
+        getattr(model, "uri", repr(model)),
+        instruction,
+        tuple(sorted(x.__name__ for x in tools or [])),
+        getattr(search_index, "id", None),
+    )
+
+
+class AssistantPool:
+    """Ассистенты создаются при первом запросе конфигурации и переиспользуются.
+
+    Пользователи различаются только тредами, поэтому первый ответ новому пользователю
+    не ждёт создания ассистента и в облаке не копятся ассистенты на каждый чат.
+    Ассистент, не использовавшийся почти весь срок жизни, пересоздаётся при следующем запросе.
+    """
+
+    def __init__(self, sdk, ttl=ASSISTANT_TTL_SECONDS - TTL_MARGIN_SECONDS):
+        self.sdk = sdk
+        self.ttl = ttl
+        # Ключ конфигурации -> [ассистент, время последнего использования]
+        self._assistants = {}
+        self._lock = threading.Lock()
+        self.recreated = 0
+
+    def __len__(self):
+        return len(self._assistants)
+
+    def get(self, model, instruction=None, search_index=None, tools=None, factory=None):
+        """Ассистент для конфигурации; factory создаёт его, если в пуле такого нет или срок жизни истекает"""
+        key = pool_key(model, instruction, search_index, tools)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._assistants.get(key)
+            if entry is None or now - entry[1] > self.ttl:
+                if entry is not None:
+                    self.recreated += 1
+                entry = self._assistants[key] = [factory(), now]
+            entry[1] = now
+            return entry[0]
+
+    def invalidate(self, assistant):
+        """Исключение из пула ассистента, которого уже нет в облаке; следующий get создаст новый"""
+        with self._lock:
+            for key, entry in list(self._assistants.items()):
+                if entry[0] is assistant:
+                    del self._assistants[key]
+                    self.recreated += 1
+
+    def close(self):
+        """Удаление всех ассистентов пула из облака"""
+        with self._lock:
+            for assistant, _ in self._assistants.values():
+                try:
+                    assistant.delete()
+                except Exception as e:
+                    print(f"Ошибка при удалении ассистента: {e}")
+            self._assistants.clear()
@@ -0,0 +1,147 @@
+"""
+Индекс каталога направлений для SearchProgramsList: таблица нормализуется один раз при загрузке,
+фильтры запроса сводятся к операциям над массивами numpy
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['Code', 'Name', 'Budget-points', 'Paid-points', 'Exams', 'Faq', 'Courses']
+# Минимальное число совпавших экзаменов, как в check_exams
+MIN_MATCHED_EXAMS = 3
+# Разделители в ячейке "Математика, и Физика, и Информатика или Русский язык"
+EXAM_SEPARATORS = re.compile(r",|;|/|\s+и\s+|\s+или\s+")
+# Названия короче этого ищутся подстрокой по ячейкам, а не по словарю экзаменов
+MIN_EXAM_LENGTH = 3
+MAX_EXAM_BITS = 64
+
+
+def split_exams(cell):
+    return [x.strip(' .') for x in EXAM_SEPARATORS.split(cell) if x.strip(' .')]
+
+
+def normalize_exam(exam):
+    """Название экзамена из запроса приводится к виду словаря: без пробелов и точек по краям, в нижнем регистре"""
+    return exam.strip(' .').lower()
+
+
+def _membership(indices, size):
+    mask = np.zeros(size, dtype=bool)
+    mask[indices] = True
+    return mask
+
+
+class ProgramIndex:
+    """Каталог направлений с предрассчитанными индексами.
+
+    - экзамены каждого направления хранятся битовой маской по словарю экзаменов каталога;
+    - коды и названия направлений - словари значение -> номера строк;
+    - проходные баллы предсортированы, отсечение по сумме баллов - бинарный поиск.
+
+    Результат select совпадает с прежним перебором таблицы в sort_table.
+    """
+
+    def __init__(self, table):
+        self.table = table.reset_index(drop=True)
+        size = len(self.table)
+        self.size = size
+
+        self.by_code = self._group(self.table['Code'])
+        self.by_name = self._group(self.table['Name'])
+
+        self.budget = pd.to_numeric(self.table['Budget-points'], errors='coerce').to_numpy(dtype=float)
+        self.paid = pd.to_numeric(self.table['Paid-points'], errors='coerce').to_numpy(dtype=float)
+        # Устойчивая сортировка: NaN уходят в конец и при отсечении не попадают в выдачу
+        self.budget_order = np.argsort(self.budget, kind='stable')
+        self.budget_sorted = self.budget[self.budget_order]
+        self.paid_order = np.argsort(self.paid, kind='stable')
+        self.paid_sorted = self.paid[self.paid_order]
+
+        # Уникальные ячейки экзаменов и номер ячейки для каждого направления
+        exams = self.table['Exams'].fillna('').astype(str).str.lower()
+        codes, cells = pd.factorize(exams)
+        self.cell_codes = codes
+        self.cells = list(cells)
+
+        self.vocabulary = {}
+        cell_masks = np.zeros(len(self.cells), dtype=np.uint64)
+        for i, cell in enumerate(self.cells):
+            for exam in split_exams(cell):
+                bit = self.vocabulary.get(exam)
+                if bit is None and len(self.vocabulary) < MAX_EXAM_BITS:
+                    bit = self.vocabulary[exam] = len(self.vocabulary)
+                if bit is not None:
+                    cell_masks[i] |= np.uint64(1) << np.uint64(bit)
+        self.exam_masks = cell_masks[codes] if size else np.zeros(0, dtype=np.uint64)
+        # Словарь заполнен полностью: отсутствие бита у направления означает отсутствие экзамена
+        self.vocabulary_complete = all(
+            exam in self.vocabulary for cell in self.cells for exam in split_exams(cell))
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _group(column):
+        groups = {}
+        for i, value in enumerate(column.tolist()):
+            groups.setdefault(value, []).append(i)
+        return {key: np.array(value, dtype=np.intp) for key, value in groups.items()}
+
+    def exam_bits(self, exam):
+        """Маска экзаменов словаря, содержащих название, или None, если нужен поиск подстрокой"""
+        exam = normalize_exam(exam)
+        if len(exam) < MIN_EXAM_LENGTH or EXAM_SEPARATORS.search(exam) or not self.vocabulary_complete:
+            return None
+        bits = np.uint64(0)
+        for name, bit in self.vocabulary.items():
+            if exam in name:
+                bits |= np.uint64(1) << np.uint64(bit)
+        return bits
+
+    def exam_matches(self, exam):
+        """Булев массив: название экзамена встречается в ячейке Exams направления"""
+        bits = self.exam_bits(exam)
+        if bits is not None:
+            return (self.exam_masks & bits) != 0
+        # Короткие и составные названия проверяются подстрокой, но только по уникальным ячейкам
+        exam = normalize_exam(exam)
+        cell_matches = np.fromiter((exam in cell for cell in self.cells), dtype=bool, count=len(self.cells))
+        return cell_matches[self.cell_codes]
+
+    def _cutoff(self, order, sorted_scores, score):
+        count = np.searchsorted(sorted_scores, score, side='right')
+        return _membership(order[:count], self.size)
+
+    def select(self, req):
+        """Строки таблицы, подходящие под запрос SearchProgramsList, в порядке выдачи"""
+        mask = np.ones(self.size, dtype=bool)
+        if req.name:
+            mask &= _membership(self.by_name.get(req.name, []), self.size)
+        if req.code:
+            mask &= _membership(self.by_code.get(req.code, []), self.size)
+        if req.score_budget:
+            mask &= self._cutoff(self.budget_order, self.budget_sorted, req.score_budget)
+        if req.score_paid:
+            mask &= self._cutoff(self.paid_order, self.paid_sorted, req.score_paid)
+        if req.exams:
+            matched = np.zeros(self.size, dtype=np.int32)
+            for exam in req.exams.split(', '):
+                if normalize_exam(exam):
+                    matched += self.exam_matches(exam)
+            mask &= matched >= MIN_MATCHED_EXAMS
+
+        order = None
+        if req.sort_order in ('least points', 'most points'):
+            if req.score_budget:
+                order = self.budget_order
+            elif req.score_paid:
+                order = self.paid_order
+        if order is None:
+            rows = np.flatnonzero(mask)
+        else:
+            rows = order[mask[order]]
+            if req.sort_order == 'most points':
+                rows = rows[::-1]
+        return self.table.iloc[rows]
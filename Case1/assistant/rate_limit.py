@@ -0,0 +1,82 @@
+"""
+Ограничение частоты запросов к YandexGPT, общее для всех потоков и корутин процесса
+"""
+
+import random
+import threading
+import time
+
+# Запросов в секунду на старте и пределы, в которых скорость подстраивается под квоту
+DEFAULT_RATE = 5.0
+MIN_RATE = 0.2
+MAX_RATE = 20.0
+# Прибавка скорости после каждого успешного запроса
+RATE_INCREASE = 0.05
+# Пауза после ошибки квоты, удваивается при повторных ошибках подряд
+BASE_PAUSE = 1.0
+MAX_PAUSE = 60.0
+
+
+class TokenBucket:
+    """Корзина токенов с подстройкой скорости под квоту (AIMD).
+
+    Каждый запрос забирает токен; токены пополняются со скоростью rate. Успешный запрос
+    понемногу увеличивает rate, ошибка квоты вдвое уменьшает его и ставит все запросы
+    на паузу. Так скорость держится у потолка квоты, а не заведомо ниже него.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=None, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 increase=RATE_INCREASE, base_pause=BASE_PAUSE, max_pause=MAX_PAUSE):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.base_pause = base_pause
+        self.max_pause = max_pause
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.resume_at = 0.0
+        self.pause = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Забирает токен и возвращает 0 или время, через которое стоит попробовать снова"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.resume_at:
+                return self.resume_at - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self.capacity = max(1.0, self.rate)
+            self.pause = 0.0
+
+    def throttle(self):
+        """Ошибка квоты: снижение скорости и общая пауза. Возвращает длительность паузы"""
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.capacity = max(1.0, self.rate)
+            self.tokens = 0.0
+            self.pause = min(self.max_pause, max(self.base_pause, self.pause * 2))
+            pause = self.pause * random.uniform(0.5, 1.0)
+            now = time.monotonic()
+            self.resume_at = max(self.resume_at, now + pause)
+            self.updated = self.resume_at
+            return pause
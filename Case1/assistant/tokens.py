@@ -0,0 +1,95 @@
+"""
+Кэш подсчёта токенов и офлайн-оценка числа токенов по числу символов
+"""
+
+import json
+import os
+import threading
+
+from assistant.uploads import chunk_key
+
+# Грубая оценка, пока в кэше нет ни одного замера
+DEFAULT_CHARS_PER_TOKEN = 2.0
+
+
+class TokenCache:
+    """Постоянный кэш числа токенов: хэш текста -> токены, символы и категория"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (json.JSONDecodeError, IOError) as e:
+                print(f"Ошибка при чтении кэша токенов: {e}")
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        return entry["tokens"] if entry else None
+
+    def put(self, key, tokens, chars, category=None):
+        with self._lock:
+            self.entries[key] = {"tokens": tokens, "chars": chars, "category": category}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+class TokenEstimator:
+    """Оценка числа токенов по соотношению символов и токенов, подобранному по замерам из кэша.
+
+    Соотношение считается отдельно для каждой категории (chats, docs, facts) как
+    отношение суммы символов к сумме токенов, для неизвестных категорий - по всем замерам.
+    """
+
+    def __init__(self, ratios=None, default_ratio=DEFAULT_CHARS_PER_TOKEN):
+        self.ratios = ratios or {}
+        self.default_ratio = default_ratio
+
+    @classmethod
+    def fit(cls, cache):
+        chars, tokens = {}, {}
+        for entry in cache.entries.values():
+            if not entry["tokens"]:
+                continue
+            for category in (entry.get("category"), None):
+                chars[category] = chars.get(category, 0) + entry["chars"]
+                tokens[category] = tokens.get(category, 0) + entry["tokens"]
+        ratios = {category: chars[category] / tokens[category] for category in chars}
+        return cls(ratios, ratios.get(None, DEFAULT_CHARS_PER_TOKEN))
+
+    def ratio(self, category=None):
+        return self.ratios.get(category, self.default_ratio)
+
+    def estimate(self, text, category=None):
+        return max(1, round(len(text) / self.ratio(category))) if text else 0
+
+    def chunk_size(self, max_tokens, category=None):
+        """Размер чанка в символах, соответствующий max_tokens токенов"""
+        return int(max_tokens * self.ratio(category))
+
+
+def count_tokens(text, cache, model=None, category=None, estimator=None):
+    """Число токенов в тексте: из кэша, через удалённый токенизатор или офлайн-оценкой.
+
+    Если model не передан, удалённый токенизатор не вызывается и используется estimator.
+    """
+    key = chunk_key(text)
+    tokens = cache.get(key)
+    if tokens is not None:
+        return tokens
+    if model is None:
+        return (estimator or TokenEstimator.fit(cache)).estimate(text, category)
+    tokens = len(model.tokenize(text))
+    cache.put(key, tokens, len(text), category)
+    return tokens
@@ -0,0 +1,224 @@
+"""
+Лёгкая трассировка пути запроса: длительности этапов (span) собираются в гистограммы,
+которые отдаются в текстовом формате Prometheus с локального HTTP-эндпоинта /metrics.
+Этапы внутри запроса (request) запоминаются, и медленные запросы пишутся в лог с разбивкой по этапам.
+"""
+
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунд: от операций с хранилищем до долгих запусков ассистента
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Запросы дольше этого пишутся в лог с разбивкой по этапам, секунд
+SLOW_REQUEST_SECONDS = 10.0
+# Сколько этапов одного запроса запоминается для разбивки
+MAX_SPANS = 200
+METRICS_PREFIX = 'priem_bot'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    """Гистограмма Prometheus с фиксированными корзинами для одного значения метки"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def render(self, name, label, value):
+        lines = []
+        cumulative = 0
+        labels = f'{label}="{escape_label(value)}"'
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Trace:
+    """Этапы одного запроса в порядке начала: [имя, глубина вложенности, длительность]"""
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.depth = 0
+        self.dropped = 0
+
+    def format(self, elapsed):
+        lines = [f'{self.name}: {elapsed:.2f} с']
+        for name, depth, duration in self.spans:
+            lines.append(f'{"  " * (depth + 1)}{name}: {duration:.3f} с')
+        if self.dropped:
+            lines.append(f'  ... ещё этапов: {self.dropped}')
+        return '\n'.join(lines)
+
+
+class Tracer:
+    """
+    Этапы (span) и запросы (request) с гистограммами длительностей.
+    Текущий запрос хранится в threading.local: обработчики бота выполняются каждый в своём потоке,
+    этапы из фоновых потоков попадают только в гистограммы.
+    """
+
+    def __init__(self, buckets=BUCKETS, slow_threshold=SLOW_REQUEST_SECONDS):
+        self.buckets = buckets
+        self.slow_threshold = slow_threshold
+        self.spans = {}
+        self.requests = {}
+        self.slow_requests = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._server = None
+
+    def _observe(self, histograms, name, value):
+        with self._lock:
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name):
+        trace = getattr(self._local, 'trace', None)
+        entry = None
+        if trace is not None:
+            if len(trace.spans) < MAX_SPANS:
+                entry = [name, trace.depth, 0.0]
+                trace.spans.append(entry)
+            else:
+                trace.dropped += 1
+            trace.depth += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._observe(self.spans, name, elapsed)
+            if trace is not None:
+                trace.depth -= 1
+                if entry is not None:
+                    entry[2] = elapsed
+
+    @contextmanager
+    def request(self, name):
+        """Корневой этап запроса; вложенный вызов работает как обычный span"""
+        if getattr(self._local, 'trace', None) is not None:
+            with self.span(name):
+                yield
+            return
+        trace = self._local.trace = Trace(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._local.trace = None
+            self._observe(self.requests, name, elapsed)
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                with self._lock:
+                    self.slow_requests += 1
+                logger.warning(f"Медленный запрос {trace.format(elapsed)}")
+
+    def traced(self, name):
+        """Декоратор: вызов функции как этап name"""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def traced_request(self, name=None):
+        """Декоратор обработчика: вызов функции как запрос (по умолчанию с именем функции)"""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.request(name or fn.__name__):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def instrument(self, obj, methods, prefix):
+        """Оборачивает методы объекта (например, send_message бота) в этапы prefix.method"""
+        for method in methods:
+            setattr(obj, method, self.traced(f'{prefix}.{method}')(getattr(obj, method)))
+        return obj
+
+    def render(self):
+        """Гистограммы в текстовом формате Prometheus"""
+        lines = []
+        with self._lock:
+            for metric, label, histograms, help_text in (
+                    ('span_duration_seconds', 'span', self.spans, 'Длительность этапов обработки запроса'),
+                    ('request_duration_seconds', 'handler', self.requests, 'Длительность обработки запроса')):
+                name = f'{METRICS_PREFIX}_{metric}'
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for value, histogram in sorted(histograms.items()):
+                    lines.extend(histogram.render(name, label, value))
+            name = f'{METRICS_PREFIX}_slow_requests_total'
+            lines.append(f'# HELP {name} Число запросов дольше порога slow_threshold')
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {self.slow_requests}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Эндпоинт /metrics в фоновом потоке"""
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = tracer.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        logger.info(f"Метрики доступны на http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+tracer = Tracer()
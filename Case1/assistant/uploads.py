@@ -0,0 +1,163 @@
+"""
+Параллельная загрузка чанков в облако с повторами и манифестом завершённых загрузок
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Максимальное число одновременных запросов upload_bytes
+MAX_WORKERS = 8
+# Повторы при превышении квоты
+MAX_RETRIES = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+# Время жизни загруженных файлов (совпадает с ttl_days при загрузке)
+FILE_TTL_DAYS = 1
+# Запас по времени, после которого запись манифеста считается устаревшей
+TTL_MARGIN_SECONDS = 60 * 60
+
+# Коды gRPC и HTTP, при которых запрос можно повторить
+RETRYABLE_CODES = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED")
+RETRYABLE_HTTP_STATUSES = (429, 503)
+RETRYABLE_PATTERN = re.compile(r"\b(?:" + "|".join(RETRYABLE_CODES) + r")\b")
+
+
+def chunk_key(text):
+    """Ключ чанка - sha256 от его содержимого"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_retryable(error):
+    """Проверка по коду ошибки, что её можно повторить (квота, временная недоступность)"""
+    code = getattr(error, "code", None)
+    if callable(code):
+        try:
+            name = getattr(code(), "name", None)
+        except Exception:
+            name = None
+        if name is not None:
+            return name in RETRYABLE_CODES
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_HTTP_STATUSES
+    # Ошибка без кода: SDK мог передать статус gRPC только в тексте, ищется имя статуса целым словом
+    return RETRYABLE_PATTERN.search(str(error)) is not None
+
+
+class UploadManifest:
+    """Манифест завершённых загрузок в формате JSONL: ключ чанка -> ID файла.
+
+    Каждая успешная загрузка сразу дописывается в файл, поэтому прерванный запуск
+    продолжает с того места, где остановился. Записи старше времени жизни файлов
+    игнорируются.
+    """
+
+    def __init__(self, path, ttl_days=FILE_TTL_DAYS):
+        self.path = path
+        self.ttl_seconds = ttl_days * 24 * 60 * 60 - TTL_MARGIN_SECONDS
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        now = time.time()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Последняя строка могла оборваться при аварийном завершении
+                    continue
+                if now - entry.get("uploaded_at", 0) < self.ttl_seconds:
+                    entries[entry["key"]] = entry["file_id"]
+        return entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def record(self, key, file_id):
+        entry = {"key": key, "file_id": file_id, "uploaded_at": time.time()}
+        with self._lock:
+            self._entries[key] = file_id
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def upload_text(sdk, text, max_retries=MAX_RETRIES):
+    """Загрузка одного чанка с экспоненциальной задержкой при ошибках квоты"""
+    for attempt in range(max_retries + 1):
+        try:
+            file = sdk.files.upload_bytes(
+                text.encode(),
+                ttl_days=FILE_TTL_DAYS,
+                expiration_policy="static",
+                mime_type="text/markdown"
+            )
+            return file.id
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = min(MAX_DELAY, BASE_DELAY * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            print(f"Ошибка загрузки ({e}), повтор через {delay:.1f} с...")
+            time.sleep(delay)
+
+
+def iter_uploads(sdk, chunks, manifest=None, max_workers=MAX_WORKERS):
+    """Загрузка чанков с ограниченной параллельностью, пары (ключ, ID файла) выдаются по мере готовности.
+
+    Уже загруженные по манифесту чанки выдаются сразу и повторно не отправляются,
+    одинаковые чанки загружаются один раз.
+    """
+    done = {}
+    to_upload = {}
+    for text in chunks:
+        key = chunk_key(text)
+        if key in done or key in to_upload:
+            continue
+        file_id = manifest.get(key) if manifest is not None else None
+        if file_id:
+            done[key] = file_id
+        else:
+            to_upload[key] = text
+
+    def job(key, text):
+        file_id = upload_text(sdk, text)
+        if manifest is not None:
+            manifest.record(key, file_id)
+        return key, file_id
+
+    if to_upload:
+        print(f"Загрузка {len(to_upload)} чанков ({len(done)} уже загружено)...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Загрузки стартуют до выдачи уже готовых чанков, чтобы потребитель их не задерживал
+        futures = [executor.submit(job, key, text) for key, text in to_upload.items()]
+        yield from done.items()
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def upload_chunks(sdk, chunks, manifest=None, max_workers=MAX_WORKERS):
+    """Загрузка списка чанков, ID файлов возвращаются в том же порядке, что и чанки"""
+    file_ids = dict(iter_uploads(sdk, chunks, manifest, max_workers))
+    return [file_ids[chunk_key(text)] for text in chunks]
@@ -0,0 +1,175 @@
+"""
+Нагрузочный тест очереди к операторам: прежняя очередь в SQLite (Storage) и OperatorQueue
+с журналом. Сотни абитуриентов встают в очередь и каждый раунд спрашивают своё место,
+свободные администраторы принимают первого в очереди, диалог - несколько сообщений с поиском
+собеседника, после чего администратор освобождается. Для OperatorQueue заявку принимает
+администратор, дольше всех не получавший заявок; для Storage - случайный свободный,
+как первый нажавший кнопку.
+
+Запуск из директории Case1: python -m benchmarks.bench_operator_queue --applicants 500 --admins 10
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from telegram_bot.operator_queue import OperatorQueue
+from telegram_bot.storage import Storage
+
+ADMIN_BASE = 10 ** 9
+MESSAGES_PER_DIALOG = 6
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, directory):
+        self.storage = Storage(os.path.join(directory, 'bot.sqlite3'))
+
+    def enqueue(self, user_id):
+        return self.storage.enqueue(user_id)
+
+    def position(self, user_id):
+        return self.storage.queue_position(user_id)
+
+    def connect(self, admin_id):
+        # create_dialog не сообщает, кто соединён, поэтому собеседник ищется отдельным запросом
+        return self.storage.get_visavi(admin_id) if self.storage.create_dialog(admin_id) else None
+
+    def get_visavi(self, user_id):
+        return self.storage.get_visavi(user_id)
+
+    def stop_dialog(self, user_id):
+        return self.storage.stop_dialog(user_id)
+
+    def pick_admin(self, free, rng):
+        return rng.choice(free)
+
+    def close(self):
+        self.storage.close()
+
+
+class MemoryBackend:
+    name = 'operator_queue'
+
+    def __init__(self, directory):
+        self.wal_path = os.path.join(directory, 'operator_queue.wal')
+        self.queue = OperatorQueue(self.wal_path)
+
+    def enqueue(self, user_id):
+        return self.queue.enqueue(user_id)
+
+    def position(self, user_id):
+        return self.queue.position(user_id)
+
+    def connect(self, admin_id):
+        return self.queue.connect(admin_id)
+
+    def get_visavi(self, user_id):
+        return self.queue.get_visavi(user_id)
+
+    def stop_dialog(self, user_id):
+        return self.queue.stop_dialog(user_id)
+
+    def pick_admin(self, free, rng):
+        return self.queue.free_admins(free)[0]
+
+    def close(self):
+        self.queue.close()
+
+
+def simulate(backend, applicants, admins, polls, seed):
+    """Прогон сценария; возвращает задержки операций по типам и число диалогов у каждого администратора"""
+    rng = random.Random(seed)
+    timings = {'enqueue': [], 'position': [], 'connect': [], 'get_visavi': [], 'stop_dialog': []}
+
+    def timed(op, *args):
+        started = time.perf_counter()
+        result = getattr(backend, op)(*args)
+        timings[op].append(time.perf_counter() - started)
+        return result
+
+    waiting = list(range(1, applicants + 1))
+    for user_id in waiting:
+        timed('enqueue', user_id)
+
+    admin_ids = [ADMIN_BASE + i for i in range(admins)]
+    served = {admin_id: 0 for admin_id in admin_ids}
+    busy = {}
+    waiting = set(waiting)
+    while waiting or busy:
+        # Ожидающие спрашивают место в очереди
+        for user_id in rng.sample(sorted(waiting), min(len(waiting), polls)):
+            timed('position', user_id)
+        # Свободные администраторы по одному принимают заявки
+        free = [admin_id for admin_id in admin_ids if admin_id not in busy]
+        while free and waiting:
+            admin_id = backend.pick_admin(free, rng)
+            free.remove(admin_id)
+            user_id = timed('connect', admin_id)
+            waiting.discard(user_id)
+            busy[admin_id] = rng.randint(1, MESSAGES_PER_DIALOG)
+            served[admin_id] += 1
+        # Переписка: каждое сообщение ищет собеседника, закончившиеся диалоги закрываются
+        for admin_id in list(busy):
+            user_id = timed('get_visavi', admin_id)
+            timed('get_visavi', user_id)
+            busy[admin_id] -= 1
+            if busy[admin_id] <= 0:
+                timed('stop_dialog', rng.choice([admin_id, user_id]))
+                del busy[admin_id]
+    return timings, served
+
+
+def report_row(name, timings, served, elapsed):
+    row = {'backend': name, 'total_s': elapsed}
+    for op, values in timings.items():
+        row[f'{op}_p50_us'] = percentile(values, 0.5) * 1e6
+        row[f'{op}_p99_us'] = percentile(values, 0.99) * 1e6
+    counts = list(served.values())
+    row['dialogs_min/max'] = f'{min(counts)}/{max(counts)}'
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест очереди к операторам')
+    parser.add_argument('--applicants', type=int, default=500)
+    parser.add_argument('--admins', type=int, default=10)
+    parser.add_argument('--polls', type=int, default=100, help='запросов места в очереди за раунд')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for backend_cls in (SQLiteBackend, MemoryBackend):
+            backend = backend_cls(directory)
+            started = time.perf_counter()
+            timings, served = simulate(backend, args.applicants, args.admins, args.polls, args.seed)
+            rows.append(report_row(backend.name, timings, served, time.perf_counter() - started))
+            backend.close()
+
+        # Восстановление состояния из журнала при перезапуске
+        wal_path = os.path.join(directory, 'operator_queue.wal')
+        wal_size = os.path.getsize(wal_path)
+        started = time.perf_counter()
+        restored = OperatorQueue(wal_path)
+        replay = time.perf_counter() - started
+        restored.close()
+
+    print(f'Абитуриентов: {args.applicants}, администраторов: {args.admins}')
+    for row in rows:
+        print('\n'.join(f'  {key}: {value:.2f}' if isinstance(value, float) else f'  {key}: {value}'
+                        for key, value in row.items()))
+        print()
+    print(f'Журнал: {wal_size / 1024:.1f} КБ, восстановление {replay * 1000:.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Бенчмарк поиска направлений: прежний перебор таблицы в sort_table и ProgramIndex
+на синтетическом каталоге.
+
+Запуск из директории Case1: python -m benchmarks.bench_programs --programs 10000
+"""
+
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from assistant.programs import COLUMNS, ProgramIndex, normalize_exam
+
+EXAMS = ['Математика', 'Физика', 'Информатика', 'Биология', 'География', 'Обществознание',
+         'Иностранный язык', 'История', 'Русский язык']
+SORT_ORDERS = [None, 'least points', 'medium points', 'most points']
+QUERIES = 300
+# Названия экзаменов от модели бывают с лишними пробелами и точками
+EXAM_PADDINGS = ['{}', '{} ', ' {}', '{}.', '{} .']
+
+
+def make_catalogue(size, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(size):
+        first, second, third, fourth = rng.sample(EXAMS, 4)
+        budget = rng.randint(150, 300)
+        rows.append([
+            f'{rng.randint(1, 45):02d}.{rng.randint(1, 5):02d}.{i % 100:02d}',
+            f'Направление {i}',
+            budget,
+            budget - rng.randint(20, 80),
+            f'{first}, и {second}, и {third} или {fourth}',
+            '',
+            f'Профиль {i}',
+        ])
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def make_queries(table, count, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        row = table.iloc[rng.randrange(len(table))]
+        budget = rng.choice([None, rng.randint(150, 300)])
+        queries.append(SimpleNamespace(
+            name=row['Name'] if rng.random() < 0.1 else None,
+            code=row['Code'] if rng.random() < 0.2 else None,
+            score_budget=budget,
+            score_paid=None if budget else rng.randint(100, 280),
+            exams=', '.join(rng.choice(EXAM_PADDINGS).format(exam) for exam in rng.sample(EXAMS, 3))
+            if rng.random() < 0.8 else None,
+            sort_order=rng.choice(SORT_ORDERS),
+        ))
+    return queries
+
+
+def legacy_select(req, table):
+    """Прежний sort_table до форматирования: копия таблицы, фильтры и check_exams по строкам.
+    Названия экзаменов нормализуются так же, как в ProgramIndex, иначе 'Физика ' не находилась бы
+    в ячейке 'Математика, и Физика, ...'
+    """
+    x = table.copy()
+    if req.name:
+        x = x[x['Name'] == req.name]
+    if req.code:
+        x = x[x['Code'] == req.code]
+    if req.score_budget:
+        x = x[x['Budget-points'] <= req.score_budget]
+    if req.score_paid:
+        x = x[x['Paid-points'] <= req.score_paid]
+    if req.exams:
+        exams = [normalize_exam(exam) for exam in req.exams.split(', ') if normalize_exam(exam)]
+        x['Contains_all_exams'] = [sum(1 for exam in exams if exam in cell.lower()) >= 3
+                                   for cell in x['Exams']]
+        x = x[x['Contains_all_exams'] == True]
+    if req.sort_order and len(x) > 0:
+        column = 'Budget-points' if req.score_budget else 'Paid-points' if req.score_paid else None
+        if column and req.sort_order == 'least points':
+            x = x.sort_values(by=column)
+        elif column and req.sort_order == 'most points':
+            x = x.sort_values(by=column, ascending=False)
+    return x
+
+
+def same_result(req, legacy, indexed):
+    """Одинаковый набор направлений, а при сортировке - одинаковая последовательность баллов"""
+    if set(legacy.index) != set(indexed.index):
+        return False
+    if req.sort_order in ('least points', 'most points') and (req.score_budget or req.score_paid):
+        column = 'Budget-points' if req.score_budget else 'Paid-points'
+        return list(legacy[column]) == list(indexed[column])
+    return list(legacy.index) == list(indexed.index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк поиска направлений')
+    parser.add_argument('--programs', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=QUERIES)
+    args = parser.parse_args()
+
+    table = make_catalogue(args.programs)
+    queries = make_queries(table, args.queries)
+
+    started = time.perf_counter()
+    index = ProgramIndex(table)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    legacy = [legacy_select(req, table) for req in queries]
+    legacy_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [index.select(req) for req in queries]
+    indexed_time = time.perf_counter() - started
+
+    mismatches = sum(not same_result(req, a, b) for req, a, b in zip(queries, legacy, indexed))
+    print(f'Направлений: {args.programs}, запросов: {args.queries}, словарь экзаменов: {len(index.vocabulary)}')
+    print(f'Построение индекса: {build * 1000:.1f} мс')
+    print(f"{'Способ':<10} {'мс/запрос':>10} {'запросов/с':>11}")
+    for name, seconds in (('legacy', legacy_time), ('index', indexed_time)):
+        print(f'{name:<10} {seconds / args.queries * 1000:>10.3f} {args.queries / seconds:>11.0f}')
+    print(f'Ускорение: {legacy_time / indexed_time:.1f}x, расхождений: {mismatches}')
+
+
+if __name__ == '__main__':
+    main()
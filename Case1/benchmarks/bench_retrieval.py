@@ -0,0 +1,210 @@
+"""
+Офлайн-бенчмарк поиска по базе знаний для разных стратегий разбиения на чанки.
+
+Вопросы берутся из telegram_bot_data/ground_truth.json, поиск - локальный LocalSearchIndex
+(по умолчанию только BM25, с --dense - гибридный). Эталонных фрагментов в ground_truth.json нет,
+поэтому они размечаются автоматически: эталон вопроса - строки базы знаний (по одной на чанк
+в стратегии rows), покрывающие не меньше GOLD_RATIO от лучшего покрытия токенов эталонного ответа.
+Чанк любой стратегии считается найденным эталоном, если содержит CONTAIN_RATIO его токенов.
+
+Запуск из директории Case1: python -m benchmarks.bench_retrieval [--dense] [--output report.md]
+"""
+
+import argparse
+import json
+import os
+import time
+
+from assistant.chunking import (DATA_DIR, get_files, get_category, chunk_facts, chunk_docs, chunk_chats, format_dialog,
+                               pack_chats)
+from assistant.local_search import LocalSearchIndex, SentenceTransformerEmbedder, tokenize
+from assistant.md_tables import iter_chats
+from assistant.tokens import TokenCache, TokenEstimator
+
+GROUND_TRUTH_PATH = os.path.join(os.path.dirname(DATA_DIR), "telegram_bot_data", "ground_truth.json")
+TOKEN_CACHE_PATH = os.path.join(DATA_DIR, "cache", "token_counts.json")
+K_VALUES = (1, 3, 5, 10)
+# Вопросы, ответ на которые покрыт базой знаний хуже этого, не оцениваются
+MIN_COVERAGE = 0.3
+GOLD_RATIO = 0.9
+CONTAIN_RATIO = 0.8
+DIALOG_GROUP = 5
+WINDOW_TOKENS = 300
+WINDOW_OVERLAP = 50
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def group_dialogs(lines, estimator=None, size=DIALOG_GROUP):
+    """Чаты: по size подряд идущих диалогов одного года в чанке"""
+    chunks, group, year = [], [], None
+    for row in iter_chats(lines):
+        if group and (row.year != year or len(group) == size):
+            chunks.append("\n\n".join(group))
+            group = []
+        year = row.year
+        group.append(format_dialog(row))
+    if group:
+        chunks.append("\n\n".join(group))
+    return chunks
+
+
+def split_windows(text, size, overlap):
+    """Окна по size символов с перекрытием overlap, границы сдвигаются к ближайшему пробелу"""
+    windows, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            end = space if space > 0 else end
+        windows.append(text[start:end].strip())
+        if end == len(text):
+            break
+        start = max(start + 1, end - overlap)
+    return [window for window in windows if window]
+
+
+def token_windows(lines, estimator, tokens=WINDOW_TOKENS, overlap=WINDOW_OVERLAP):
+    """Документы: скользящие окна по tokens токенов поверх строк таблицы"""
+    text = "\n\n".join(chunk_docs(lines))
+    return split_windows(text, estimator.chunk_size(tokens, "docs"), estimator.chunk_size(overlap, "docs"))
+
+
+def per_row(chunker):
+    return lambda lines, estimator=None: chunker(lines)
+
+
+def packed(max_tokens, overlap=1):
+    """Чаты: упаковка диалогов одного года в чанки до max_tokens токенов (chunk_file по умолчанию)"""
+    return lambda lines, estimator=None: pack_chats(lines, max_tokens, overlap, estimator)
+
+
+# Стратегия: чанкер для каждой категории файлов
+STRATEGIES = {
+    "rows": {"facts": per_row(chunk_facts), "docs": per_row(chunk_docs), "chats": per_row(chunk_chats)},
+    "dialogs": {"facts": per_row(chunk_facts), "docs": per_row(chunk_docs), "chats": group_dialogs},
+    "windows": {"facts": per_row(chunk_facts), "docs": token_windows, "chats": per_row(chunk_chats)},
+    "packed-400": {"facts": per_row(chunk_facts), "docs": per_row(chunk_docs), "chats": packed(400)},
+    "packed-800": {"facts": per_row(chunk_facts), "docs": per_row(chunk_docs), "chats": packed(800)},
+    "packed-800-no-overlap": {"facts": per_row(chunk_facts), "docs": per_row(chunk_docs), "chats": packed(800, 0)},
+}
+
+
+def build_chunks(strategy, files, estimator):
+    chunks = []
+    for filename in files:
+        with open(filename, "r", encoding="utf-8") as f:
+            chunks.extend(strategy[get_category(filename)](f, estimator))
+    return chunks
+
+
+def label_questions(ground_truth, units):
+    """Эталонные строки базы знаний для каждого вопроса (наборы токенов)"""
+    unit_tokens = [set(tokenize(unit)) for unit in units]
+    labelled = []
+    for item in ground_truth:
+        answer = set(tokenize(item["ground_truth"]))
+        if not answer:
+            continue
+        coverage = [len(answer & tokens) / len(answer) for tokens in unit_tokens]
+        best = max(coverage, default=0.0)
+        if best < MIN_COVERAGE:
+            continue
+        gold = [unit_tokens[i] for i, value in enumerate(coverage) if value >= best * GOLD_RATIO and unit_tokens[i]]
+        labelled.append((item["question"], gold))
+    return labelled
+
+
+def contains(chunk_tokens, unit_tokens):
+    return len(chunk_tokens & unit_tokens) >= CONTAIN_RATIO * len(unit_tokens)
+
+
+def evaluate_strategy(name, strategy, files, labelled, estimator, embedder=None):
+    started = time.perf_counter()
+    chunks = build_chunks(strategy, files, estimator)
+    index = LocalSearchIndex(chunks, embedder)
+    build_time = time.perf_counter() - started
+
+    chunk_tokens = {}
+    recalls = {k: 0.0 for k in K_VALUES}
+    reciprocal_ranks = 0.0
+    latencies = []
+    for question, gold in labelled:
+        started = time.perf_counter()
+        results = index.search(question, max(K_VALUES)).results
+        latencies.append(time.perf_counter() - started)
+
+        found_at = {}
+        first_relevant = None
+        for rank, result in enumerate(results, 1):
+            tokens = chunk_tokens.get(result.chunk)
+            if tokens is None:
+                tokens = chunk_tokens[result.chunk] = set(tokenize(result.content))
+            hits = [i for i, unit in enumerate(gold) if i not in found_at and contains(tokens, unit)]
+            for i in hits:
+                found_at[i] = rank
+            if hits and first_relevant is None:
+                first_relevant = rank
+        for k in K_VALUES:
+            recalls[k] += sum(1 for rank in found_at.values() if rank <= k) / len(gold)
+        if first_relevant:
+            reciprocal_ranks += 1 / first_relevant
+
+    n = len(labelled) or 1
+    sizes = [estimator.estimate(chunk) for chunk in chunks]
+    return {
+        "strategy": name,
+        "chunks": len(chunks),
+        "avg_tokens": sum(sizes) / len(sizes) if sizes else 0,
+        "max_tokens": max(sizes, default=0),
+        "build_s": build_time,
+        **{f"recall@{k}": recalls[k] / n for k in K_VALUES},
+        "mrr": reciprocal_ranks / n,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def format_report(rows, questions, retriever):
+    columns = list(rows[0])
+    lines = [f"Вопросов: {questions}, поиск: {retriever}", "",
+             "| " + " | ".join(columns) + " |",
+             "|" + "|".join(":-:" for _ in columns) + "|"]
+    for row in rows:
+        lines.append("| " + " | ".join(f"{value:.3f}" if isinstance(value, float) else str(value)
+                                       for value in row.values()) + " |")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поиска для стратегий разбиения на чанки")
+    parser.add_argument("--strategies", nargs="+", default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument("--dense", action="store_true", help="гибридный поиск BM25 + эмбеддинги")
+    parser.add_argument("--output", help="сохранить отчёт (.md или .json)")
+    args = parser.parse_args()
+
+    with open(GROUND_TRUTH_PATH, "r", encoding="utf-8") as f:
+        ground_truth = json.load(f)
+    files = get_files()
+    estimator = TokenEstimator.fit(TokenCache(TOKEN_CACHE_PATH))
+    embedder = SentenceTransformerEmbedder() if args.dense else None
+
+    labelled = label_questions(ground_truth, build_chunks(STRATEGIES["rows"], files, estimator))
+    rows = [evaluate_strategy(name, STRATEGIES[name], files, labelled, estimator, embedder)
+            for name in args.strategies]
+    report = format_report(rows, len(labelled), "BM25 + dense (RRF)" if args.dense else "BM25")
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            if args.output.endswith(".json"):
+                json.dump(rows, f, ensure_ascii=False, indent=4)
+            else:
+                f.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Бенчмарк разбора таблиц чатов: прежний разбор через read()/split() и потоковый парсер md_tables.
+
+Запуск из директории Case1: python -m benchmarks.bench_tables
+"""
+
+import os
+import time
+import tracemalloc
+from glob import glob
+
+from assistant.chunking import DATA_DIR
+from assistant.md_tables import iter_chats
+
+REPEATS = 5
+
+
+def legacy_parse(filename):
+    """Прежний разбор: файл целиком в памяти, строки делятся по | без учёта экранирования"""
+    with open(filename, "r", encoding="utf-8") as f:
+        content = f.read()
+    rows = 0
+    for line in content.split("\n"):
+        parts = line.split("|")
+        if len(parts) < 4:
+            continue
+        question = parts[1].strip().split("<br>")
+        answer = parts[2].strip().split("<br>")
+        rows += bool(question and answer)
+    return rows
+
+
+def streaming_parse(filename):
+    """Потоковый разбор построчно с типизированными строками"""
+    with open(filename, "r", encoding="utf-8") as f:
+        return sum(1 for _ in iter_chats(f))
+
+
+def measure(parse, filename):
+    """Лучшее время из REPEATS запусков и пик памяти одного запуска"""
+    best = float("inf")
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        rows = parse(filename)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    parse(filename)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, best, peak
+
+
+def main():
+    files = sorted(glob(os.path.join(DATA_DIR, "chats", "*.md")))
+    print(f"{'Файл':<10} {'Парсер':<10} {'Строк':>6} {'МБ/с':>8} {'Строк/с':>10} {'Пик, КБ':>9}")
+    for filename in files:
+        size_mb = os.path.getsize(filename) / 2 ** 20
+        for name, parse in (("legacy", legacy_parse), ("streaming", streaming_parse)):
+            rows, seconds, peak = measure(parse, filename)
+            print(f"{os.path.basename(filename):<10} {name:<10} {rows:>6} {size_mb / seconds:>8.1f} "
+                  f"{rows / seconds:>10.0f} {peak / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
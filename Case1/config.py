@@ -9,4 +9,39 @@ class Config(BaseSettings):
     #Yandex Cloud
     api_key: str
     folder_id: str
-    search_index_id: str
\ No newline at end of file
+    search_index_id: str
+
+    # Путь к локальному гибридному индексу (assistant/local_search.py), если пусто - облачный индекс
+    local_index_path: str = ''
+
+    # Семантический кэш ответов (assistant/answer_cache.py)
+    answer_cache: bool = False
+    answer_cache_threshold: float = 0.92
+    answer_cache_ttl: int = 24 * 60 * 60
+    answer_cache_size: int = 1000
+
+    # Тред пользователя удаляется после стольких секунд бездействия
+    session_idle_timeout: int = 30 * 60
+
+    # Параллельная обработка сообщений (telegram_bot/dispatcher.py)
+    async_handlers: bool = True
+    max_llm_runs: int = 8
+    handler_workers: int = 32
+
+    # Период проверки MAI_Programs.xlsx на изменения, секунд (assistant/catalogue.py), 0 - не проверять
+    catalogue_poll_interval: int = 30
+
+    # Потоковый вывод ответа правками сообщения (telegram_bot/streaming.py)
+    stream_answers: bool = True
+    stream_edit_interval: float = 1.0
+
+    # Сессии пользователей (telegram_bot/sessions.py)
+    max_sessions: int = 1000
+    session_history_turns: int = 10
+    session_keep_messages: int = 4
+    session_summarize: bool = False
+
+    # Трассировка (assistant/tracing.py): эндпоинт /metrics на localhost (например, 9464), 0 - выключен;
+    # запросы дольше slow_request_seconds пишутся в лог с разбивкой по этапам
+    metrics_port: int = 0
+    slow_request_seconds: float = 10.0
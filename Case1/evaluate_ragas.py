@@ -2,69 +2,160 @@ from ragas import evaluate
 from ragas.metrics import faithfulness, answer_relevancy, answer_correctness
 from datasets import Dataset
 import pandas as pd
+import asyncio
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
-import time
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models import BaseLLM
 from langchain_core.outputs import LLMResult, Generation
 from langchain_huggingface import HuggingFaceEmbeddings
+from assistant.answer_cache import normalize_question
 from assistant.assistant import sdk, model
+from assistant.disk_cache import DiskCache, cache_key
+from assistant.rate_limit import TokenBucket
+from assistant.uploads import is_retryable
 from pydantic.v1 import Field
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Parallel judge calls per batch; the request rate itself is set by TokenBucket
+MAX_CONCURRENCY = 8
+MAX_RETRIES = 5
+
+# Judge responses and embeddings from previous runs; only new or changed samples cost API calls
+CACHE_PATH = Path('data/cache/ragas_cache.sqlite3')
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+cache = DiskCache(str(CACHE_PATH))
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that computes vectors only for texts it hasn't seen with this model."""
+
+    def __init__(self, embeddings, cache, model_name):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def _embed(self, namespace, texts, embed):
+        keys = [cache_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(namespace, keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            vectors = embed(list(missing.values()))
+            computed = {key: list(map(float, vector)) for key, vector in zip(missing, vectors)}
+            self.cache.put_many(namespace, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed('embeddings:documents', texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed('embeddings:query', [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+
 # Initialize embeddings
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embeddings = CachedEmbeddings(HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL), cache, EMBEDDING_MODEL)
+
+def fallback_response(prompt: str, text: str = "Error generating response") -> str:
+    """Placeholder the RAGAS metric parsers accept when the model gave no usable JSON."""
+    if "answer_correctness" in prompt.lower():
+        return json.dumps({"TP": [], "FP": [], "FN": []})
+    elif "answer_relevance" in prompt.lower():
+        return json.dumps({"question": prompt})
+    return text
+
 
 class YandexGPTLLM(BaseLLM):
     sdk: object = Field(default=None, exclude=True)
     model: object = Field(default=None, exclude=True)
+    # Shared by every thread and coroutine using this LLM, so parallel metrics stay within the quota
+    rate_limiter: object = Field(default=None, exclude=True)
+    # Responses keyed by prompt and model configuration
+    cache: object = Field(default=None, exclude=True)
+    max_concurrency: int = MAX_CONCURRENCY
+    max_retries: int = MAX_RETRIES
+    # (event loop, asyncio.Semaphore) limiting in-flight calls across all concurrent agenerate calls
+    semaphore: object = Field(default=None, exclude=True)
 
-    def __init__(self, sdk, model, **kwargs):
+    def __init__(self, sdk, model, rate_limiter=None, cache=None, **kwargs):
         super().__init__(**kwargs)
         self.model = model.configure(temperature=0.5) if hasattr(model, 'configure') else model
         self.sdk = sdk
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.cache = cache
+
+    def _model_key(self):
+        return getattr(self.model, 'uri', repr(self.model)), repr(getattr(self.model, 'config', None))
 
     def _call(self, prompt: str, stop=None, **kwargs) -> str:
-        try:
-            # Add instruction for JSON response
-            json_prompt = f"{prompt}\nReturn the response in JSON format."
-            result = self.model.run(json_prompt)
-            text = result[0].text if result and result[0].text else "No response"
-            # Validate JSON response
+        # Add instruction for JSON response
+        json_prompt = f"{prompt}\nReturn the response in JSON format."
+        key = cache_key(self._model_key(), json_prompt, stop)
+        if self.cache is not None:
+            cached = self.cache.get('llm', key)
+            if cached is not None:
+                return cached
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
             try:
-                json.loads(text)
-                return text
-            except json.JSONDecodeError:
-                logger.warning(f"Invalid JSON response: {text}")
-                # Fallback for specific metrics
-                if "answer_correctness" in prompt.lower():
-                    return json.dumps({"TP": [], "FP": [], "FN": []})
-                elif "answer_relevance" in prompt.lower():
-                    return json.dumps({"question": prompt})
-                return text
+                result = self.model.run(json_prompt)
+                self.rate_limiter.success()
+                break
+            except Exception as e:
+                if is_retryable(e) and attempt < self.max_retries:
+                    pause = self.rate_limiter.throttle()
+                    logger.warning(f"API quota exceeded, lowering rate to {self.rate_limiter.rate:.2f} req/s "
+                                   f"and pausing for {pause:.1f} seconds...")
+                    continue
+                logger.error(f"Error calling YandexGPT: {str(e)}")
+                return fallback_response(prompt)
+
+        text = result[0].text if result and result[0].text else "No response"
+        # Validate JSON response
+        try:
+            json.loads(text)
+        except json.JSONDecodeError:
+            logger.warning(f"Invalid JSON response: {text}")
+            # Fallback for specific metrics
+            return fallback_response(prompt, text)
+        # Only valid responses are cached, failures are retried on the next run
+        if self.cache is not None:
+            self.cache.put('llm', key, text)
+        return text
+
+    def _generate(self, prompts: list[str], stop=None, run_manager=None, **kwargs) -> LLMResult:
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, max(1, len(prompts)))) as executor:
+                texts = list(executor.map(lambda prompt: self._call(prompt, stop=stop, **kwargs), prompts))
+            return LLMResult(generations=[[Generation(text=text)] for text in texts])
         except Exception as e:
-            logger.error(f"Error calling YandexGPT: {str(e)}")
-            if "RESOURCE_EXHAUSTED" in str(e):
-                logger.warning("API quota exceeded, pausing for 60 seconds...")
-                time.sleep(60)  # Pause to respect API limits
-            if "answer_correctness" in prompt.lower():
-                return json.dumps({"TP": [], "FP": [], "FN": []})
-            elif "answer_relevance" in prompt.lower():
-                return json.dumps({"question": prompt})
-            return "Error generating response"
-
-    def _generate(self, prompts: list[str], *args, **kwargs) -> LLMResult:
+            logger.error(f"Error in batch generation: {str(e)}")
+            return LLMResult(generations=[[Generation(text="Error generating response")] for _ in prompts])
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """One semaphore per instance and event loop, created lazily on the running loop."""
+        loop = asyncio.get_running_loop()
+        if self.semaphore is None or self.semaphore[0] is not loop:
+            self.semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self.semaphore[1]
+
+    async def _agenerate(self, prompts: list[str], stop=None, run_manager=None, **kwargs) -> LLMResult:
+        # RAGAS runs metrics as many concurrent single-prompt coroutines; the blocking SDK call goes to
+        # a worker thread. The semaphore is shared by all of them, so at most max_concurrency are in flight
+        semaphore = self._get_semaphore()
+
+        async def call(prompt):
+            async with semaphore:
+                return await asyncio.to_thread(self._call, prompt, stop, **kwargs)
+
         try:
-            generations = []
-            for prompt in prompts:
-                text = self._call(prompt, **kwargs)
-                generations.append([Generation(text=text)])
-                time.sleep(1)  # Small delay to avoid hitting API limits
-            return LLMResult(generations=generations)
+            texts = await asyncio.gather(*(call(prompt) for prompt in prompts))
+            return LLMResult(generations=[[Generation(text=text)] for text in texts])
         except Exception as e:
             logger.error(f"Error in batch generation: {str(e)}")
             return LLMResult(generations=[[Generation(text="Error generating response")] for _ in prompts])
@@ -85,17 +176,75 @@ def load_json_file(file_path: Path):
         logger.error(f"Error loading {file_path}: {str(e)}")
         return []
 
+def index_ground_truth(ground_truth):
+    """Ground truth answers by normalized question; the first entry wins for duplicates."""
+    index = {}
+    if isinstance(ground_truth, list):
+        for item in ground_truth:
+            index.setdefault(normalize_question(item['question']), item['ground_truth'])
+    return index
+
+
+def sample_key(entry):
+    """A sample is re-evaluated only when its question, contexts, answer or ground truth change."""
+    return cache_key(entry['question'], entry['contexts'], entry['answer'], entry.get('ground_truth'))
+
+
+def load_samples(results_path: Path):
+    """Per-sample scores from a previous run, by sample key."""
+    results = load_json_file(results_path)
+    if not isinstance(results, dict):
+        return {}
+    return {sample['key']: sample for sample in results.get('samples', [])}
+
+
+def aggregate(samples, metric_names):
+    """Mean of each metric over the samples that have a score for it."""
+    totals = {}
+    for name in metric_names:
+        values = [sample['scores'][name] for sample in samples if sample['scores'].get(name) is not None]
+        totals[name] = sum(values) / len(values) if values else None
+    return totals
+
+
+def score_samples(entries, metrics, llm):
+    """Run RAGAS on the entries and return their per-sample scores in the same order."""
+    columns = ['question', 'contexts', 'answer'] + (['ground_truth'] if any('ground_truth' in x for x in entries) else [])
+    dataset = Dataset.from_pandas(pd.DataFrame([{column: x.get(column) for column in columns} for x in entries]))
+    result = evaluate(
+        dataset=dataset,
+        metrics=metrics,
+        llm=llm,
+        embeddings=embeddings,
+        is_async=True,
+        max_workers=MAX_CONCURRENCY
+    )
+    scores = result.to_pandas()
+    samples = []
+    for entry, (_, row) in zip(entries, scores.iterrows()):
+        samples.append({
+            'key': entry['key'],
+            'id': entry.get('id'),
+            'question': entry['question'],
+            # NaN (metric failed for this sample) is stored as null and skipped in the aggregates
+            'scores': {metric.name: None if pd.isna(row.get(metric.name)) else float(row[metric.name])
+                       for metric in metrics},
+        })
+    return samples
+
+
 def main():
     # Initialize LLM
-    yandex_llm = YandexGPTLLM(sdk=sdk, model=model)
+    yandex_llm = YandexGPTLLM(sdk=sdk, model=model, cache=cache)
 
     # Load logs and ground truth
     log_path = Path('telegram_bot_data/interaction_logs.json')
     ground_truth_path = Path('telegram_bot_data/ground_truth.json')
-    
+    results_path = Path('telegram_bot_data/ragas_results.json')
+
     logs = load_json_file(log_path)
-    ground_truth = load_json_file(ground_truth_path)
-    
+    ground_truth = index_ground_truth(load_json_file(ground_truth_path))
+
     if not logs:
         logger.error("No interaction logs found. Please ensure the logs file exists and contains data.")
         return
@@ -106,54 +255,54 @@ def main():
         if not all(key in log for key in ['question', 'context', 'answer']):
             logger.warning(f"Skipping log entry due to missing required fields: {log}")
             continue
-            
+
         entry = {
+            'id': log.get('id'),
             'question': log['question'],
             'contexts': log['context'] if isinstance(log['context'], list) else [log['context']],
             'answer': log['answer']
         }
-        
-        if isinstance(ground_truth, list) and any(item['question'] == log['question'] for item in ground_truth):
-            for item in ground_truth:
-                if item['question'] == log['question']:
-                    entry['ground_truth'] = item['ground_truth']
-                    break
-        
+
+        truth = ground_truth.get(normalize_question(log['question']))
+        if truth is not None:
+            entry['ground_truth'] = truth
+
+        entry['key'] = sample_key(entry)
         data.append(entry)
 
     if not data:
         logger.error("No valid data entries found for evaluation")
         return
 
-    dataset = Dataset.from_pandas(pd.DataFrame(data))
-
     metrics = [
         faithfulness,
         answer_relevancy,
         answer_correctness
     ]
 
-    try:
-        result = evaluate(
-            dataset=dataset,
-            metrics=metrics,
-            llm=yandex_llm,
-            embeddings=embeddings
-        )
-
-        results_path = Path('telegram_bot_data/ragas_results.json')
-        results_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        with open(results_path, 'w', encoding='utf-8') as f:
-            json.dump(dict(result), f, ensure_ascii=False, indent=4)
-
-        logger.info("Evaluation completed successfully")
-        logger.info("Results:")
-        for metric, value in result.items():
-            logger.info(f"{metric}: {value}")
+    previous = load_samples(results_path)
+    pending = [entry for entry in data if entry['key'] not in previous]
+    logger.info(f"{len(data) - len(pending)} samples already scored, {len(pending)} to evaluate")
 
+    try:
+        scored = {sample['key']: sample for sample in score_samples(pending, metrics, yandex_llm)} if pending else {}
     except Exception as e:
         logger.error(f"Error during evaluation: {str(e)}")
+        return
+
+    # Samples of entries that are no longer in the logs are dropped
+    samples = [scored.get(entry['key']) or previous[entry['key']] for entry in data]
+    result = aggregate(samples, [metric.name for metric in metrics])
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump({**result, 'samples': samples}, f, ensure_ascii=False, indent=4)
+
+    logger.info("Evaluation completed successfully")
+    logger.info("Results:")
+    for metric, value in result.items():
+        logger.info(f"{metric}: {value}")
+    logger.info(f"Cache: {cache.stats()}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,13 +1,26 @@
+import argparse
 import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import logging
-from assistant.assistant import sdk, model, instruction, search_index
+from assistant.assistant import sdk, model, instruction, search_index, assistant_pool
 from assistant.funcs import Agent, SearchProgramsList, HandOver
+from assistant.uploads import is_retryable
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Concurrent requests to the assistant; keep within the folder's request quota
+DEFAULT_WORKERS = 4
+MAX_RETRIES = 5
+BASE_DELAY = 2.0
+MAX_DELAY = 60.0
+CHECKPOINT_PATH = Path('telegram_bot_data/generated_answers.jsonl')
+
 def load_json_file(file_path: Path):
     """Load JSON file with error handling."""
     try:
@@ -26,13 +39,105 @@ def save_json_file(file_path: Path, data):
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=4)
         logger.info(f"Successfully saved {file_path}")
+        return True
     except Exception as e:
         logger.error(f"Error saving {file_path}: {str(e)}")
+        return False
+
+class Checkpoint:
+    """Append-only JSONL file with the answers generated so far, keyed by log entry."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        answers = {}
+        if not self.path.exists():
+            return answers
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut off by a crash
+                    continue
+                answers[entry['key']] = entry['answer']
+        return answers
+
+    def record(self, key, question, answer):
+        line = json.dumps({'key': key, 'question': question, 'answer': answer}, ensure_ascii=False)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+class RateLimitBackoff:
+    """Backoff shared by all workers.
+
+    A quota error pauses every worker, not just the one that hit it, and the pause doubles
+    while errors keep coming. Successful calls shrink it back.
+    """
+
+    def __init__(self, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+        self.resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self._lock:
+                remaining = self.resume_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def failure(self):
+        with self._lock:
+            self.delay = min(self.max_delay, max(self.base_delay, self.delay * 2))
+            pause = self.delay * random.uniform(0.5, 1.0)
+            self.resume_at = max(self.resume_at, time.monotonic() + pause)
+            return pause
+
+    def success(self):
+        with self._lock:
+            self.delay /= 2
+            if self.delay < self.base_delay:
+                self.delay = 0.0
+
+
+def entry_key(log, position):
+    """Stable key of a log entry for the checkpoint: its id, or its position in the file."""
+    return str(log.get('id', position))
 
-def generate_answers():
-    # Initialize Agent with tools and instruction
+
+def generate_answer(agent, prompt, backoff, max_retries=MAX_RETRIES):
+    """Answer one prompt on a fresh thread, retrying quota and availability errors."""
+    for attempt in range(max_retries + 1):
+        backoff.wait()
+        try:
+            text = agent(prompt).text
+            backoff.success()
+            return text
+        except Exception as e:
+            if not is_retryable(e) or attempt == max_retries:
+                raise
+            pause = backoff.failure()
+            logger.warning(f"Rate limited ({e}), retrying in {pause:.1f}s")
+        finally:
+            # Every question gets its own thread so earlier answers don't leak into later ones
+            agent.done()
+
+
+def generate_answers(workers=DEFAULT_WORKERS, checkpoint_path=CHECKPOINT_PATH, max_retries=MAX_RETRIES):
     tools = [SearchProgramsList, HandOver]
-    agent = Agent(sdk=sdk, model=model, instruction=instruction, search_index=search_index, tools=tools)
 
     # Load interaction logs
     log_path = Path('telegram_bot_data/interaction_logs.json')
@@ -42,35 +147,81 @@ def generate_answers():
         logger.error("No interaction logs found. Please ensure the logs file exists.")
         return
 
-    # Process each log entry
-    for log in logs:
+    checkpoint = Checkpoint(Path(checkpoint_path))
+    done = checkpoint.load()
+    if done:
+        logger.info(f"Resuming from checkpoint with {len(done)} answers")
+
+    pending = []
+    for position, log in enumerate(logs):
         if not all(key in log for key in ['question', 'context', 'answer']):
             logger.warning(f"Skipping log entry due to missing required fields: {log}")
             continue
 
+        key = entry_key(log, position)
+        if key in done and not log['answer']:
+            log['answer'] = done[key]
+
         # Skip if answer already exists (optional, can be removed)
         if log['answer']:
             logger.info(f"Answer already exists for question: {log['question']}")
             continue
 
+        pending.append((key, log))
+
+    # One agent per worker thread; all of them share a single pooled assistant
+    local = threading.local()
+    agents = []
+    agents_lock = threading.Lock()
+
+    def get_agent():
+        if not hasattr(local, 'agent'):
+            local.agent = Agent(sdk=sdk, model=model, instruction=instruction, search_index=search_index,
+                                tools=tools, pool=assistant_pool)
+            with agents_lock:
+                agents.append(local.agent)
+        return local.agent
+
+    backoff = RateLimitBackoff()
+
+    def process(key, log):
         # Create prompt combining context and question
         prompt = f"{instruction}\n\nКонтекст: {log['context']}\nВопрос: {log['question']}"
+        answer = generate_answer(get_agent(), prompt, backoff, max_retries)
+        checkpoint.record(key, log['question'], answer)
+        return answer
 
-        try:
-            # Generate answer using Agent
-            answer = agent(prompt)
-            log['answer'] = answer
-            logger.info(f"Generated answer for question: {log['question']}")
-        except Exception as e:
-            logger.error(f"Error generating answer for question {log['question']}: {str(e)}")
-            log['answer'] = "Error generating response"
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='answer') as executor:
+        futures = {executor.submit(process, key, log): log for key, log in pending}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            log = futures[future]
+            try:
+                log['answer'] = future.result()
+                logger.info(f"Generated answer for question: {log['question']}")
+            except Exception as e:
+                logger.error(f"Error generating answer for question {log['question']}: {str(e)}")
+                log['answer'] = "Error generating response"
+            elapsed = time.monotonic() - started
+            logger.info(f"Progress: {completed}/{len(pending)} ({completed / elapsed:.2f} answers/s)")
 
-    # Save updated logs
-    save_json_file(log_path, logs)
+    # Save updated logs; the checkpoint is only needed until they are on disk
+    if save_json_file(log_path, logs):
+        checkpoint.remove()
     logger.info("Answer generation completed")
 
     # Clean up
-    agent.done()
+    for agent in agents:
+        agent.done()
+    assistant_pool.close()
+
 
 if __name__ == "__main__":
-    generate_answers()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Generate answers for interaction logs')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='number of concurrent requests to the assistant')
+    parser.add_argument('--checkpoint', default=str(CHECKPOINT_PATH),
+                        help='JSONL file with answers generated so far')
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES)
+    args = parser.parse_args()
+    generate_answers(workers=args.workers, checkpoint_path=args.checkpoint, max_retries=args.max_retries)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import telebot
+
+logger = logging.getLogger(__name__)
+
+# Очередь пользователя закрывается после стольких секунд без новых сообщений
+QUEUE_IDLE_SECONDS = 60
+# Сколько последних задержек хранится для перцентилей
+LATENCY_WINDOW = 1000
+
+
+def update_key(args):
+    """Чат, к которому относится обновление: сообщения одного чата обрабатываются по порядку"""
+    if not args:
+        return None
+    update = args[0]
+    if isinstance(update, telebot.types.CallbackQuery):
+        return update.message.chat.id if update.message else update.from_user.id
+    chat = getattr(update, 'chat', None)
+    return chat.id if chat else None
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class UpdateDispatcher:
+    """
+    Диспетчер обработчиков на asyncio.
+    Обновления разных чатов обрабатываются параллельно в пуле потоков, обновления
+    одного чата - строго по порядку. Число одновременных запусков LLM ограничено
+    семафором llm_slot, чтобы обработчики без LLM не ждали медленных ответов.
+    """
+
+    def __init__(self, max_llm_runs=8, max_workers=32):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='handler')
+        self.llm_semaphore = threading.BoundedSemaphore(max_llm_runs)
+        self.max_llm_runs = max_llm_runs
+        self.queues = {}
+        self.in_flight = 0
+        self.llm_in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+        self.processed = 0
+        self.failed = 0
+        self._counter_lock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='dispatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, task, *args, **kwargs):
+        """Постановка обработчика в очередь; вызывается из потока опроса Telegram"""
+        item = (task, args, kwargs, time.monotonic())
+        self.loop.call_soon_threadsafe(self._enqueue, update_key(args), item)
+
+    def _enqueue(self, key, item):
+        if key is None:
+            # Служебные обработчики без чата выполняются без упорядочивания
+            self.loop.create_task(self._run(item))
+            return
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = asyncio.Queue()
+            self.loop.create_task(self._worker(key, queue))
+        queue.put_nowait(item)
+
+    async def _worker(self, key, queue):
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), QUEUE_IDLE_SECONDS)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self.queues[key]
+                    return
+                continue
+            await self._run(item)
+
+    async def _run(self, item):
+        task, args, kwargs, enqueued = item
+        started = time.monotonic()
+        self.in_flight += 1
+        try:
+            await self.loop.run_in_executor(self.executor, lambda: task(*args, **kwargs))
+        except Exception as e:
+            self.failed += 1
+            logger.exception(f"Ошибка в обработчике {getattr(task, '__name__', task)}: {e}")
+        finally:
+            self.in_flight -= 1
+            self.processed += 1
+            finished = time.monotonic()
+            self.waits.append(started - enqueued)
+            self.latencies.append(finished - enqueued)
+
+    @contextmanager
+    def llm_slot(self):
+        """Ограничение числа одновременных запусков ассистента"""
+        with self.llm_semaphore:
+            with self._counter_lock:
+                self.llm_in_flight += 1
+            try:
+                yield
+            finally:
+                with self._counter_lock:
+                    self.llm_in_flight -= 1
+
+    def queue_depth(self):
+        return sum(queue.qsize() for queue in list(self.queues.values()))
+
+    def stats(self):
+        latencies = list(self.latencies)
+        waits = list(self.waits)
+        return {
+            'queue_depth': self.queue_depth(),
+            'active_chats': len(self.queues),
+            'in_flight': self.in_flight,
+            'llm_in_flight': self.llm_in_flight,
+            'llm_limit': self.max_llm_runs,
+            'processed': self.processed,
+            'failed': self.failed,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p95': percentile(latencies, 0.95),
+            'wait_p95': percentile(waits, 0.95),
+        }
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """TeleBot, передающий обработчики в UpdateDispatcher вместо собственного пула потоков"""
+
+    def __init__(self, token, dispatcher, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        self.dispatcher = dispatcher
+
+    def _exec_task(self, task, *args, **kwargs):
+        self.dispatcher.submit(task, *args, **kwargs)
+
+    def stop_bot(self):
+        super().stop_bot()
+        self.dispatcher.close()
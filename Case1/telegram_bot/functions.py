@@ -1,36 +1,32 @@
-import json
-from pathlib import Path
+import sqlite3
 from assistant.funcs import *
 from assistant.assistant import *
+from assistant.tracing import tracer
+from telegram_bot.operator_queue import OperatorQueue
+from telegram_bot.sessions import SessionManager, make_summarizer
+from telegram_bot.storage import Storage
 
 
+storage = Storage('../telegram_bot_data/bot.sqlite3',
+                  users_json='../telegram_bot_data/users.json',
+                  callstack_json='../telegram_bot_data/callstack.json')
+
+# Очередь к операторам и диалоги хранятся в памяти, изменения пишутся в журнал
+operator_queue = OperatorQueue('../telegram_bot_data/operator_queue.wal')
+if not operator_queue.restored:
+    operator_queue.import_state(*storage.export_queue())
+
+
+@tracer.traced('storage.save_user')
 def save_user(user_id: int, user_nick: int, role: str = 'user'):
-    file_path = '../telegram_bot_data/users.json'
-    file = Path(file_path)
-
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении файла: {e}")
-            data = {}
-
-    data[user_id] = {
-        'user_nick': user_nick,
-        'role': role
-    }
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        storage.save_user(user_id, user_nick, role)
         return True
-    except IOError as e:
-        raise IOError(f"Ошибка при записи данных в файл '{file_path}': {e}")
+    except sqlite3.Error as e:
+        raise IOError(f"Ошибка при записи данных пользователя '{user_id}': {e}")
 
 
+@tracer.traced('storage.update_user_role')
 def update_user_role(user_id: int, new_role: str):
     """
     Изменяет роль пользователя по его уникальному идентификатору.
@@ -40,187 +36,78 @@ def update_user_role(user_id: int, new_role: str):
     Возвращает:
         bool: True, если роль была успешно изменена, иначе False
     """
-    file_path = '../telegram_bot_data/users.json'
-    file = Path(file_path)
-
-    # Загружаем существующие данные или создаем пустой словарь
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            return False
-
-    if str(user_id) in data:
-        data[str(user_id)]['role'] = new_role
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-            return True
-        except IOError as e:
-            raise IOError(f"Ошибка при изменении данных в файл '{file_path}': {e}")
-    else:
-        return False
+    try:
+        return storage.update_user_role(user_id, new_role)
+    except sqlite3.Error as e:
+        raise IOError(f"Ошибка при изменении роли пользователя '{user_id}': {e}")
 
 
+@tracer.traced('storage.admin_ids')
 def get_all_admin_ids():
     """
     Возвращает список всех ID пользователей с ролью 'admin'.
     Возвращает:
         list: список всех ID администраторов
     """
-    file_path = '../telegram_bot_data/users.json'
-    file = Path(file_path)
-
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении файла: {e}")
-            return []
-    admin_ids = [user_id for user_id, user_data in data.items() if user_data.get('role') == 'admin']
-    return admin_ids
+    return list(storage.admin_ids())
 
 
+@tracer.traced('storage.is_admin')
+def is_admin(user_id):
+    """
+    Проверяет, является ли пользователь администратором, без чтения базы (множество администраторов кэшируется).
+    """
+    return storage.is_admin(user_id)
+
+
+@tracer.traced('queue.enqueue')
 def stay_in_quire(user_id):
-    file_path = '../telegram_bot_data/callstack.json'
-    file = Path(file_path)
-
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении файла: {e}")
-            data = {}
-    if any(user_id == i for i in data['queue']):
-        return data['queue'].index(user_id) + 1
-    data['queue'].append(user_id)
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        return True
-    except IOError as e:
-        raise IOError(f"Ошибка при записи данных в файл '{file_path}': {e}")
+    return operator_queue.enqueue(user_id)
 
 
+@tracer.traced('queue.connect')
 def create_dialog(admins_id):
-    file_path = '../telegram_bot_data/callstack.json'
-    file = Path(file_path)
-
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении файла: {e}")
-            data = {}
-
-    for dialog in data.get('dialogs', []):
-        if admins_id in dialog:
-            return False
-
-    if not data.get('queue'):
-        return False
-
-    dialog = [data['queue'][0], admins_id]
-    if 'dialogs' not in data:
-        data['dialogs'] = []
-    data['dialogs'].append(dialog)
-    del data['queue'][0]
-
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-        return True
-    except IOError as e:
-        raise IOError(f"Ошибка при записи данных в файл '{file_path}': {e}")
+    """
+    Соединяет администратора с первым абитуриентом в очереди.
+    Возвращает:
+        int | None: ID абитуриента или None, если очередь пуста или администратор уже в диалоге
+    """
+    return operator_queue.connect(admins_id)
 
 
+@tracer.traced('queue.get_visavi')
 def get_visavi(user_id):
-    file_path = '../telegram_bot_data/callstack.json'
-    file = Path(file_path)
-
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении файла: {e}")
-            return False
-    for dialog in data['dialogs']:
-        if dialog[0] == user_id:
-            return dialog[1]
-        if dialog[1] == user_id:
-            return dialog[0]
-    return False
+    return operator_queue.get_visavi(user_id)
 
 
+@tracer.traced('queue.stop_dialog')
 def stop_dialog(user_id):
-    file_path = '../telegram_bot_data/callstack.json'
-    file = Path(file_path)
-
-    data = {}
-    if file.exists():
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    data = {}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении файла: {e}")
-            data = {}
-
-    if 'dialogs' not in data:
-        data['dialogs'] = []
-
-    dialog_index = None
-    for i, dialog in enumerate(data['dialogs']):
-        if user_id in dialog:
-            dialog_index = i
-            break
-
-    if dialog_index is not None:
-        del data['dialogs'][dialog_index]
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
-            return True
-        except IOError as e:
-            raise IOError(f"Ошибка при записи данных в файл '{file_path}': {e}")
-    return False
-
-def get_or_create_assistant(assistants: dict, user_id: int):
-    if user_id in assistants:
-        return assistants[user_id]
-    assistants[user_id] = Agent(sdk=sdk, model=model, instruction=instruction, search_index=search_index,
-                                tools=[SearchProgramsList, HandOver])
-    return assistants[user_id]
-
-
-def clear_assistants(assistants, user_id):
-    if user_id in assistants:
-        try:
-            assistants[user_id].done()
-            del assistants[user_id]
-        except Exception as e:
-            print(e)
+    return operator_queue.stop_dialog(user_id)
+
+
+@tracer.traced('queue.free_admins')
+def get_free_admins():
+    """Свободные администраторы в порядке очереди на новую заявку (дольше всех без заявок - первыми)"""
+    return operator_queue.free_admins(get_all_admin_ids())
+
+def create_agent():
+    return Agent(sdk=sdk, model=model, instruction=instruction, search_index=search_index,
+                 tools=[SearchProgramsList, HandOver], answer_cache=answer_cache, pool=assistant_pool)
+
+
+sessions = SessionManager(create_agent, idle_timeout=config.session_idle_timeout, max_sessions=config.max_sessions,
+                          history_turns=config.session_history_turns, keep_messages=config.session_keep_messages,
+                          summarize=make_summarizer(model) if config.session_summarize else None)
+
+
+@tracer.traced('sessions.get')
+def get_or_create_assistant(user_id: int):
+    return sessions.get(user_id)
+
+
+@tracer.traced('sessions.close')
+def clear_assistants(user_id):
+    sessions.close(user_id)
 
 
 def reset_user_handover(user_id):
@@ -0,0 +1,182 @@
+"""
+Журнал взаимодействий бота: запись в JSONL в фоновом потоке, ротация и сборка в interaction_logs.json.
+
+Сборка закрытых сегментов в JSON для generate_answers.py и evaluate_ragas.py (из директории Case1):
+
+    python -m telegram_bot.interaction_log --log-dir telegram_bot_data/interaction_logs \
+        --output telegram_bot_data/interaction_logs.json
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from glob import glob
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_NAME = 'current.jsonl'
+SEGMENT_PATTERN = 'segment-*.jsonl'
+MAX_BYTES = 10 * 2 ** 20
+MAX_AGE_SECONDS = 24 * 60 * 60
+FLUSH_INTERVAL = 1.0
+BATCH_SIZE = 100
+
+
+class InteractionLogWriter:
+    """
+    Журнал в формате JSONL: обработчик только кладёт запись в очередь, запись на диск
+    выполняет фоновый поток пачками. Активный файл ротируется по размеру и возрасту.
+    """
+
+    def __init__(self, log_dir, max_bytes=MAX_BYTES, max_age=MAX_AGE_SECONDS, flush_interval=FLUSH_INTERVAL):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.flush_interval = flush_interval
+        self.active_path = os.path.join(log_dir, ACTIVE_NAME)
+        os.makedirs(log_dir, exist_ok=True)
+        self._queue = queue.Queue()
+        self._file = None
+        self._opened_at = None
+        self._thread = threading.Thread(target=self._run, name='interaction-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, entry):
+        """Неблокирующая постановка записи в очередь"""
+        entry.setdefault('timestamp', time.time())
+        self._queue.put(entry)
+
+    def _open(self):
+        self._file = open(self.active_path, 'a', encoding='utf-8')
+        if self._opened_at is None:
+            # После перезапуска возраст активного файла отсчитывается от его создания
+            self._opened_at = os.path.getctime(self.active_path) if self._file.tell() else time.time()
+
+    def _rotate_if_needed(self):
+        if self._file is None:
+            return
+        too_big = self._file.tell() >= self.max_bytes
+        too_old = time.time() - self._opened_at >= self.max_age
+        if (too_big or too_old) and self._file.tell():
+            self.rotate()
+
+    def rotate(self):
+        """Закрытие активного файла и переименование его в сегмент"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.active_path) and os.path.getsize(self.active_path):
+            segment = os.path.join(self.log_dir, f"segment-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10 ** 9:09d}.jsonl")
+            os.replace(self.active_path, segment)
+        self._opened_at = None
+
+    def _write(self, batch):
+        if self._file is None:
+            self._open()
+        self._file.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in batch))
+        self._file.flush()
+        self._rotate_if_needed()
+
+    def _run(self):
+        while True:
+            try:
+                entry = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                if self._file is not None:
+                    self._rotate_if_needed()
+                continue
+            if entry is None:
+                break
+            batch = [entry]
+            stop = False
+            while len(batch) < BATCH_SIZE:
+                try:
+                    entry = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stop = True
+                    break
+                batch.append(entry)
+            try:
+                self._write(batch)
+            except IOError as e:
+                logger.error(f"Ошибка записи журнала взаимодействий: {e}")
+            if stop:
+                break
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Дописывает оставшиеся в очереди записи и останавливает поток"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+def read_jsonl(path):
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Оборванная последняя строка после аварийного завершения
+                continue
+    return entries
+
+
+def compact(log_dir, output_path, include_active=False):
+    """
+    Дописывает записи из закрытых сегментов в JSON-массив output_path
+    (формат, который читают generate_answers.py и evaluate_ragas.py) и удаляет эти сегменты.
+    Возвращает число добавленных записей.
+    """
+    segments = sorted(glob(os.path.join(log_dir, SEGMENT_PATTERN)))
+    active = os.path.join(log_dir, ACTIVE_NAME)
+    if include_active and os.path.exists(active):
+        segments.append(active)
+    if not segments:
+        return 0
+
+    logs = []
+    if os.path.exists(output_path):
+        with open(output_path, 'r', encoding='utf-8') as f:
+            try:
+                logs = json.load(f)
+            except json.JSONDecodeError:
+                logs = []
+    next_id = max((log.get('id', 0) for log in logs), default=0) + 1
+
+    added = 0
+    for segment in segments:
+        for entry in read_jsonl(segment):
+            entry.setdefault('id', next_id)
+            next_id += 1
+            logs.append(entry)
+            added += 1
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(logs, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, output_path)
+    for segment in segments:
+        os.remove(segment)
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сборка журнала взаимодействий в JSON')
+    parser.add_argument('--log-dir', default=os.path.join('telegram_bot_data', 'interaction_logs'))
+    parser.add_argument('--output', default=os.path.join('telegram_bot_data', 'interaction_logs.json'))
+    parser.add_argument('--include-active', action='store_true',
+                        help='забрать и активный файл (только при остановленном боте)')
+    args = parser.parse_args()
+    print(f'Добавлено записей: {compact(args.log_dir, args.output, args.include_active)}')
@@ -2,13 +2,17 @@ import telebot
 from telebot import types
 from config import Config
 import logging
-from functions import (save_user, update_user_role, get_all_admin_ids, stop_dialog,
-                      stay_in_quire, create_dialog, get_visavi)
+from functions import (save_user, update_user_role, get_all_admin_ids, get_free_admins, is_admin, stop_dialog,
+                      stay_in_quire, create_dialog, get_visavi, get_or_create_assistant, clear_assistants, sessions,
+                      operator_queue)
 from assistant.assistant import *
 from assistant.funcs import *
-from telegram_bot.functions import get_or_create_assistant, clear_assistants
-import json
-from pathlib import Path
+from assistant.tracing import tracer
+from telegram_bot.dispatcher import UpdateDispatcher, DispatchingTeleBot
+from telegram_bot.interaction_log import InteractionLogWriter
+from telegram_bot.notifications import AdminNotifier, format_history
+from telegram_bot.streaming import MessageStreamer
+from contextlib import ExitStack, contextmanager
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,41 +24,66 @@ if not config.bot_token:
     logger.error("Не указан TELEGRAM_BOT_TOKEN в .env файле!")
     exit(1)
 
-bot = telebot.TeleBot(config.bot_token)
-calling_admin = dict()
-assistants = dict()
+if config.async_handlers:
+    # Обработчики разных пользователей выполняются параллельно, одного пользователя - по порядку
+    dispatcher = UpdateDispatcher(max_llm_runs=config.max_llm_runs, max_workers=config.handler_workers)
+    bot = DispatchingTeleBot(config.bot_token, dispatcher)
+else:
+    dispatcher = None
+    bot = telebot.TeleBot(config.bot_token)
+# Вызовы Telegram API попадают в трассировку как этапы telegram.*
+tracer.instrument(bot, ('send_message', 'edit_message_text', 'edit_message_reply_markup', 'delete_message'), 'telegram')
+tracer.slow_threshold = config.slow_request_seconds
+if config.metrics_port:
+    try:
+        tracer.serve(config.metrics_port)
+    except OSError as e:
+        # Порт занят (второй экземпляр бота, другой экспортер) - бот работает без эндпоинта
+        logger.warning(f"Не удалось открыть эндпоинт метрик на порту {config.metrics_port}: {e}")
+notifier = AdminNotifier(bot)
+
+if config.catalogue_poll_interval:
+    # Обновлённый MAI_Programs.xlsx подхватывается без перезапуска бота
+    catalogue.watch(config.catalogue_poll_interval)
+
+@contextmanager
+def llm_slot():
+    """Слот для запуска ассистента с учётом ограничения на число одновременных запусков.
+    Ожидание слота попадает в трассировку отдельным этапом llm_slot.wait"""
+    with ExitStack() as stack:
+        if dispatcher:
+            with tracer.span('llm_slot.wait'):
+                stack.enter_context(dispatcher.llm_slot())
+        yield
+
+# Журнал взаимодействий пишется в фоне, в interaction_logs.json собирается командой
+# python -m telegram_bot.interaction_log
+interaction_log = InteractionLogWriter('../telegram_bot_data/interaction_logs')
 
 # Функция для логирования взаимодействий
+@tracer.traced('interaction_log.write')
 def log_interaction(user_id, question, context, answer):
-    log_path = '../telegram_bot_data/interaction_logs.json'
     log_entry = {
         'user_id': user_id,
         'question': question,
         'context': context,
         'answer': answer
     }
-    logs = []
-    if Path(log_path).exists():
-        with open(log_path, 'r', encoding='utf-8') as f:
-            try:
-                logs = json.load(f)
-            except json.JSONDecodeError:
-                logs = []
-    logs.append(log_entry)
-    with open(log_path, 'w', encoding='utf-8') as f:
-        json.dump(logs, f, ensure_ascii=False, indent=4)
+    interaction_log.log(log_entry)
 
 @bot.message_handler(commands=['start'])
+@tracer.traced_request()
 def start_message(message):
     text_first = '''Привет! Я бот приемной комиссии МАИ.
 Задавай свои вопросы, я с радостью на них отвечу.'''
 
     save_user(message.chat.id, user_nick=message.chat.username, role='user')
-    get_or_create_assistant(assistants, message.chat.id)
+    get_or_create_assistant(message.chat.id)
     markup = types.ReplyKeyboardRemove()
     bot.send_message(message.chat.id, text_first, reply_markup=markup)
 
 @bot.message_handler(commands=['admin'])
+@tracer.traced_request()
 def admin_registration(message):
     if len(message.text.split(' ')) != 2:
         text = 'Команда использована неверно, отправьте ее заново (правильный вид - /admin "пароль").'
@@ -66,7 +95,34 @@ def admin_registration(message):
         markup = types.ReplyKeyboardRemove()
         bot.send_message(message.chat.id, text, reply_markup=markup)
 
+@bot.message_handler(commands=['stats'])
+@tracer.traced_request()
+def cache_stats(message):
+    if not is_admin(message.chat.id):
+        return
+    lines = []
+    if answer_cache is None:
+        lines.append('Кэш ответов выключен.')
+    else:
+        stats = answer_cache.stats()
+        lines.append(f'Кэш ответов: {stats["size"]} записей\n'
+                     f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+                     f'без кэша: {stats["bypassed"]}, вытеснено: {stats["evictions"]}\n'
+                     f'Hit rate: {stats["hit_rate"]:.1%}')
+    stats = sessions.stats()
+    lines.append(f'Сессий: {stats["sessions"]}, закрыто по простою и лимиту: {stats["evicted"]}, '
+                 f'сокращений истории: {stats["trimmed"]}, тредов к удалению: {stats["pending_cleanup"]}')
+    if dispatcher:
+        stats = dispatcher.stats()
+        lines.append(f'Очередь: {stats["queue_depth"]} обновлений в {stats["active_chats"]} чатах\n'
+                     f'Выполняется: {stats["in_flight"]}, запусков LLM: {stats["llm_in_flight"]}/{stats["llm_limit"]}\n'
+                     f'Обработано: {stats["processed"]}, ошибок: {stats["failed"]}\n'
+                     f'Задержка p50/p95: {stats["latency_p50"]:.1f}/{stats["latency_p95"]:.1f} с, '
+                     f'ожидание в очереди p95: {stats["wait_p95"]:.1f} с')
+    bot.send_message(message.chat.id, '\n\n'.join(lines))
+
 @bot.callback_query_handler(func=lambda call: call.data == 'queue_position')
+@tracer.traced_request()
 def handle_queue_position(call):
     queue_button = types.InlineKeyboardMarkup()
     queue_button.add(types.InlineKeyboardButton(text='Узнать место в очереди', callback_data='queue_position'))
@@ -74,8 +130,9 @@ def handle_queue_position(call):
     chat_id = call.message.chat.id
     message_id = call.message.message_id
 
-    place = stay_in_quire(chat_id)
-    if place is True:  # Если очередь пуста или пользователь первый
+    # Только узнаём место: повторная постановка в очередь уже соединённого пользователя не нужна
+    place = operator_queue.position(chat_id)
+    if place == 1:  # Если пользователь первый
         text = 'Вы следующий в очереди!'
     elif place:  # Если есть конкретная позиция
         text = f'Вы в очереди на {place} месте.'
@@ -90,42 +147,60 @@ def handle_queue_position(call):
     )
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_'))
+@tracer.traced_request()
 def handle_confirmation(call):
-    user_id = call.data.split('_')[1]
-
-    admins = get_all_admin_ids()
-    for admin_id in admins:
-        if admin_id in calling_admin:
-            try:
-                bot.delete_message(admin_id, calling_admin[admin_id])
-            except Exception as e:
-                print(f"Ошибка при удалении сообщения: {e}")
-            finally:
-                calling_admin.pop(admin_id, None)
-
-    if create_dialog(call.message.chat.id):
-        text = '''Спасибо за вашу инициативность.
-        Перенаправляю на чат с пользователем.'''
-        bot.send_message(call.message.chat.id, text)
-
-        bot.send_message(user_id, 'Администратор принял ваш запрос. Можете общаться.')
-    else:
-        text = 'Извините, но вы уже ведете диалог с другим пользователем. Завершите текущий диалог, чтобы начать новый.'
-        bot.send_message(call.message.chat.id, text)
+    admin_id = call.message.chat.id
+    # Администратор соединяется с первым в очереди, а не обязательно с абитуриентом из уведомления
+    user_id = create_dialog(admin_id)
+    if user_id is None:
+        if get_visavi(admin_id):
+            text = 'Извините, но вы уже ведете диалог с другим пользователем. Завершите текущий диалог, чтобы начать новый.'
+        else:
+            text = 'Заявку уже принял другой администратор, очередь пуста.'
+        bot.send_message(admin_id, text)
+        return
+
+    delete_notifications(user_id)
+
+    text = '''Спасибо за вашу инициативность.
+    Перенаправляю на чат с пользователем.'''
+    bot.send_message(admin_id, text)
+
+    bot.send_message(user_id, 'Администратор принял ваш запрос. Можете общаться.')
+
+def delete_notifications(user_id):
+    """Удаляются только уведомления о принятой заявке"""
+    for notified_admin, message_id in operator_queue.pop_notifications(user_id).items():
+        try:
+            bot.delete_message(notified_admin, message_id)
+        except Exception as e:
+            print(f"Ошибка при удалении сообщения: {e}")
+
+def offer_next_request(admin_id):
+    """Освободившемуся администратору предлагается следующая заявка из очереди"""
+    user_id = operator_queue.first()
+    if user_id is None:
+        return
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton('✅Подтвердить', callback_data=f'confirm_{user_id}'))
+    mes_id = bot.send_message(admin_id, f'В очереди к оператору ожидают: {len(operator_queue)}.', reply_markup=markup)
+    operator_queue.add_notification(user_id, admin_id, mes_id.message_id)
 
 @bot.message_handler(content_types='text')
+@tracer.traced_request()
 def message_reply(message):
     visavi = get_visavi(message.chat.id)
     user_id = message.chat.id
-    priem_agent = get_or_create_assistant(assistants, user_id)
+    priem_agent = get_or_create_assistant(user_id)
 
-    if str(user_id) in get_all_admin_ids():
+    if is_admin(user_id):
         if visavi:
             if message.text == 'Закончить беседу':
-                clear_assistants(assistants, user_id)
+                clear_assistants(user_id)
                 stop_dialog(user_id)
                 bot.send_message(user_id, 'Спасибо за беседу, контакт разорван.')
                 bot.send_message(visavi, 'Спасибо за беседу, контакт разорван.')
+                offer_next_request(user_id)
             else:
                 markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
                 button_stop = types.KeyboardButton("Закончить беседу")
@@ -136,10 +211,11 @@ def message_reply(message):
     elif priem_agent.get_handover():
         if visavi:
             if message.text == 'Закончить беседу':
-                clear_assistants(assistants, user_id)
+                clear_assistants(user_id)
                 stop_dialog(user_id)
                 bot.send_message(user_id, 'Спасибо за беседу, контакт разорван.')
                 bot.send_message(visavi, 'Спасибо за беседу, контакт разорван.')
+                offer_next_request(visavi)
             else:
                 markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
                 button_stop = types.KeyboardButton("Закончить беседу")
@@ -151,59 +227,51 @@ def message_reply(message):
                 markup = types.ReplyKeyboardRemove()
                 bot.send_message(user_id, 'Технические шоколадки, попробуйте позже',
                                 reply_markup=markup)
-    elif str(user_id) not in get_all_admin_ids():
-        # Получаем контекст
-        thread = priem_agent.get_thread()
-        context = []
-        
-        # Выполняем запрос к агенту
-        text = priem_agent(message.text)
-        
-        # Извлекаем контекст
-        if priem_agent.tools.get('SearchProgramsList') and 'Нашлись такие направления' in text:
-            # Контекст — строки из Excel, соответствующие ответу
-            context = [str(row) for _, row in tb.iterrows() if row['Code'] in text or row['Name'] in text]
-        else:
-            # Контекст — результаты поиска из индекса
-            try:
-                search_results = sdk.search_indexes.get(config.search_index_id).search(message.text)
-                context = [result.content for result in search_results.results]
-            except Exception as e:
-                print(f"Ошибка при поиске контекста: {e}")
-                context = []
+    else:
+        # Выполняем запрос к агенту, контекст - фрагменты базы знаний и результаты функций из того же запуска.
+        # В потоковом режиме пользователь сразу видит заглушку, которая дописывается по мере генерации
+        streamer = MessageStreamer(bot, user_id, interval=config.stream_edit_interval) if config.stream_answers else None
+        try:
+            with llm_slot():
+                reply = priem_agent(message.text, on_partial=streamer.update if streamer else None)
+        except Exception:
+            if streamer:
+                streamer.finish('Не удалось получить ответ, попробуйте ещё раз.')
+            raise
+        text = reply.text
+        context = reply.context
 
         # Логируем взаимодействие
         log_interaction(user_id, message.text, context, text)
-        
+
         # Отправляем ответ пользователю
-        ms = bot.send_message(user_id, text)
+        ms = streamer.finish(text) if streamer else bot.send_message(user_id, text)
+        # Длинная история переносится в новый тред фоновым потоком, уже после ответа
+        sessions.schedule_trim(user_id)
 
         if priem_agent.get_handover():
-            admins = get_all_admin_ids()
-            for id in admins:
-                history = '\n'
-                for msg in list(priem_agent.get_thread())[::-1]:
-                    history = f'{history}{msg.author.role}:** {msg.text}\n'
-                text_for_admin = (f'С вами хотят связаться.'
-                                f'Вот история переписки ассистента и пользователя:\n{history}')
-                markup = types.InlineKeyboardMarkup()
-                button_agree = types.InlineKeyboardButton(
-                    '✅Подтвердить',
-                    callback_data=f'confirm_{message.chat.id}'
-                )
-                markup.add(button_agree)
-                mes_id = bot.send_message(id, text_for_admin, reply_markup=markup)
-                calling_admin[id] = mes_id.message_id
-
+            # Пользователь встаёт в очередь до уведомлений, чтобы администратор сразу мог принять заявку
             place = stay_in_quire(user_id)
             if place and place is not True:
                 text = f'Вы уже в очереди на {place} месте.'
                 bot.send_message(user_id, text)
             else:
+                # Занятым администраторам заявка не отправляется: её предложат, когда диалог завершится.
+                # История собирается один раз из локальной копии сессии и рассылается параллельно
+                markup = types.InlineKeyboardMarkup()
+                markup.add(types.InlineKeyboardButton('✅Подтвердить', callback_data=f'confirm_{message.chat.id}'))
+                sent = notifier.broadcast(get_free_admins(), format_history(priem_agent.history()), markup)
+                for admin_id, message_id in sent.items():
+                    operator_queue.add_notification(user_id, admin_id, message_id)
+                if operator_queue.position(user_id) is None:
+                    # Заявку приняли ещё во время рассылки
+                    delete_notifications(user_id)
+
                 markup = types.InlineKeyboardMarkup()
                 button_text = 'Узнать положение в очереди'
                 button_agree = types.InlineKeyboardButton(button_text, callback_data='queue_position')
                 markup.add(button_agree)
-                bot.edit_message_text(chat_id=user_id, message_id=ms.message_id, text=text, reply_markup=markup)
+                # Текст длинного ответа не помещается в одну правку, поэтому к последней его части добавляется только кнопка
+                bot.edit_message_reply_markup(chat_id=user_id, message_id=ms.message_id, reply_markup=markup)
 
 bot.infinity_polling()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram_bot.streaming import MAX_MESSAGE_LENGTH, retry_after
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_WORKERS = 8
+HANDOVER_HEADER = 'С вами хотят связаться.Вот история переписки ассистента и пользователя:\n'
+
+
+def format_history(messages, header=HANDOVER_HEADER):
+    """
+    Текст уведомления о передаче диалога оператору из локальной копии сообщений сессии.
+    Не помещающееся в одно сообщение Telegram начало истории отбрасывается.
+    """
+    history = ''.join(f'{msg["role"]}:** {msg["text"]}\n' for msg in messages)
+    limit = MAX_MESSAGE_LENGTH - len(header) - 1
+    if len(history) > limit:
+        history = '…' + history[len(history) - limit + 1:]
+    return f'{header}\n{history}'
+
+
+class AdminNotifier:
+    """Параллельная рассылка одного сообщения нескольким администраторам"""
+
+    def __init__(self, bot, max_workers=NOTIFY_WORKERS):
+        self.bot = bot
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='notify')
+
+    def _send(self, chat_id, text, reply_markup):
+        try:
+            return self.bot.send_message(chat_id, text, reply_markup=reply_markup).message_id
+        except Exception as e:
+            pause = retry_after(e)
+            if pause is None:
+                raise
+            time.sleep(pause)
+            return self.bot.send_message(chat_id, text, reply_markup=reply_markup).message_id
+
+    def broadcast(self, chat_ids, text, reply_markup=None):
+        """Отправляет сообщение всем chat_ids; возвращает {chat_id: ID сообщения} для успешных отправок"""
+        futures = {chat_id: self.executor.submit(self._send, chat_id, text, reply_markup) for chat_id in chat_ids}
+        sent = {}
+        for chat_id, future in futures.items():
+            try:
+                sent[chat_id] = future.result()
+            except Exception as e:
+                logger.warning(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+        return sent
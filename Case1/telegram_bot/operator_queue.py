@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+from collections import deque
+
+# После стольких записей журнал сворачивается в снимок состояния
+SNAPSHOT_EVERY = 10000
+
+
+class OperatorQueue:
+    """
+    Очередь абитуриентов к операторам и активные диалоги в памяти.
+    Место в очереди вычисляется по номеру талона за O(1), собеседник ищется по словарю
+    в обе стороны. Каждое изменение сначала дописывается в журнал (write-ahead log),
+    при запуске состояние восстанавливается из снимка и журнала.
+    """
+
+    def __init__(self, wal_path, snapshot_every=SNAPSHOT_EVERY, fsync=False):
+        self.wal_path = wal_path
+        self.snapshot_path = f'{wal_path}.snapshot'
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        # Талоны выдаются по возрастанию; место = талон - талон первого в очереди + 1
+        self.tickets = {}
+        self.order = deque()
+        self.next_ticket = 1
+        self.partner = {}
+        self.admins_in_dialog = set()
+        # Номер последнего назначения администратора, для справедливого порядка уведомлений
+        self.last_assigned = {}
+        self.assignments = 0
+        # Уведомления администраторам о заявке: пользователь -> {администратор: ID сообщения}
+        self.notifications = {}
+        self._records = 0
+        # Номер последней записи журнала; снимок хранит номер, до которого он включает записи
+        self.seq = 0
+        directory = os.path.dirname(wal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.restored = self._restore()
+        self._wal = open(wal_path, 'a', encoding='utf-8')
+
+    # Журнал
+
+    def _restore(self):
+        """Снимок и затем записи журнала; возвращает False, если сохранённого состояния нет"""
+        found = False
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            for user_id in state['queue']:
+                self._enqueue(user_id)
+            for user_id, admin_id in state['dialogs']:
+                self._connect(admin_id, user_id)
+            self.last_assigned = {int(k): v for k, v in state.get('last_assigned', {}).items()}
+            self.assignments = state.get('assignments', 0)
+            self.seq = state.get('seq', 0)
+            found = True
+        if os.path.exists(self.wal_path):
+            valid = 0
+            with open(self.wal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя запись: операция не была подтверждена
+                        break
+                    valid += len(line)
+                    # Записи, уже вошедшие в снимок: сбой между сохранением снимка и очисткой журнала
+                    if record.get('seq', 0) <= self.seq:
+                        continue
+                    self.seq = record['seq']
+                    self._apply(record)
+                    self._records += 1
+                    found = True
+            # Хвост отрезается, чтобы новые записи не оказались после повреждённой строки
+            if valid < os.path.getsize(self.wal_path):
+                with open(self.wal_path, 'r+b') as f:
+                    f.truncate(valid)
+        return found
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'enqueue':
+            self._enqueue(record['user'])
+        elif op == 'connect':
+            self._connect(record['admin'], record['user'])
+        elif op == 'stop':
+            self._stop(record['user'])
+
+    def _log(self, record):
+        self.seq += 1
+        record['seq'] = self.seq
+        self._wal.write(json.dumps(record) + '\n')
+        self._wal.flush()
+        if self.fsync:
+            os.fsync(self._wal.fileno())
+        self._records += 1
+
+    def _maybe_snapshot(self):
+        """Сворачивание журнала; вызывается после применения записанной операции"""
+        if self._records >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """Сохранение состояния в снимок и очистка журнала"""
+        with self._lock:
+            state = {
+                'queue': list(self.order),
+                'dialogs': [(user_id, admin_id) for user_id, admin_id in self.partner.items()
+                            if admin_id in self.admins_in_dialog and user_id not in self.admins_in_dialog],
+                'last_assigned': self.last_assigned,
+                'assignments': self.assignments,
+                'seq': self.seq,
+            }
+            tmp_path = f'{self.snapshot_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self._wal.close()
+            self._wal = open(self.wal_path, 'w', encoding='utf-8')
+            self._records = 0
+
+    def import_state(self, queue, dialogs):
+        """Перенос очереди и диалогов из прежнего хранилища при первом запуске"""
+        with self._lock:
+            for user_id in queue:
+                self.enqueue(user_id)
+            for user_id, admin_id in dialogs:
+                user_id, admin_id = int(user_id), int(admin_id)
+                if user_id not in self.partner and admin_id not in self.partner and user_id not in self.tickets:
+                    self._log({'op': 'connect', 'admin': admin_id, 'user': user_id})
+                    self._connect(admin_id, user_id)
+                    self._maybe_snapshot()
+
+    # Изменения состояния без журнала
+
+    # Повторное применение записи ничего не меняет
+
+    def _enqueue(self, user_id):
+        if user_id in self.tickets or user_id in self.partner:
+            return
+        self.tickets[user_id] = self.next_ticket
+        self.next_ticket += 1
+        self.order.append(user_id)
+
+    def _connect(self, admin_id, user_id):
+        if user_id in self.partner or admin_id in self.partner:
+            return
+        # Соединяется только первый в очереди (или уже снятый с неё пользователь при переносе данных)
+        if self.order and self.order[0] == user_id:
+            self.order.popleft()
+            del self.tickets[user_id]
+        self.partner[user_id] = admin_id
+        self.partner[admin_id] = user_id
+        self.admins_in_dialog.add(admin_id)
+        self.assignments += 1
+        self.last_assigned[admin_id] = self.assignments
+
+    def _stop(self, user_id):
+        visavi = self.partner.pop(user_id, None)
+        if visavi is None:
+            return False
+        self.partner.pop(visavi, None)
+        self.admins_in_dialog.discard(user_id)
+        self.admins_in_dialog.discard(visavi)
+        return True
+
+    # Очередь
+
+    def position(self, user_id):
+        """Место в очереди за O(1): из очереди уходят только первые, поэтому талоны идут без пропусков"""
+        with self._lock:
+            ticket = self.tickets.get(int(user_id))
+            if ticket is None:
+                return None
+            return ticket - self.tickets[self.order[0]] + 1
+
+    def enqueue(self, user_id):
+        """Место пользователя в очереди, если он уже в ней, False для уже соединённого, иначе постановка в конец и True"""
+        user_id = int(user_id)
+        with self._lock:
+            if user_id in self.tickets:
+                return self.position(user_id)
+            if user_id in self.partner:
+                # Уже в диалоге с оператором
+                return False
+            self._log({'op': 'enqueue', 'user': user_id})
+            self._enqueue(user_id)
+            self._maybe_snapshot()
+            return True
+
+    def first(self):
+        """ID первого в очереди или None"""
+        with self._lock:
+            return self.order[0] if self.order else None
+
+    def __len__(self):
+        return len(self.order)
+
+    # Диалоги
+
+    def connect(self, admin_id):
+        """Соединяет администратора с первым в очереди; возвращает ID пользователя или None"""
+        admin_id = int(admin_id)
+        with self._lock:
+            if admin_id in self.partner or not self.order:
+                return None
+            user_id = self.order[0]
+            self._log({'op': 'connect', 'admin': admin_id, 'user': user_id})
+            self._connect(admin_id, user_id)
+            self._maybe_snapshot()
+            return user_id
+
+    def get_visavi(self, user_id):
+        return self.partner.get(int(user_id), False)
+
+    def stop_dialog(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            if user_id not in self.partner:
+                return False
+            self._log({'op': 'stop', 'user': user_id})
+            self._stop(user_id)
+            self._maybe_snapshot()
+            return True
+
+    def free_admins(self, admin_ids):
+        """Свободные администраторы: дольше всех не получавшие заявок - первыми"""
+        with self._lock:
+            free = [int(x) for x in admin_ids if int(x) not in self.admins_in_dialog]
+            return sorted(free, key=lambda x: self.last_assigned.get(x, 0))
+
+    # Уведомления о заявках (в журнал не пишутся: после перезапуска сообщения просто остаются в чатах)
+
+    def add_notification(self, user_id, admin_id, message_id):
+        with self._lock:
+            self.notifications.setdefault(int(user_id), {})[int(admin_id)] = message_id
+
+    def pop_notifications(self, user_id):
+        with self._lock:
+            return self.notifications.pop(int(user_id), {})
+
+    def close(self):
+        with self._lock:
+            self._wal.close()
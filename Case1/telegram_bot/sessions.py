@@ -0,0 +1,200 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+IDLE_TIMEOUT = 30 * 60
+MAX_SESSIONS = 1000
+# После стольких запросов в треде история переносится в новый тред
+HISTORY_TURNS = 10
+# Сколько последних сообщений (вопросов и ответов) переносится в новый тред
+KEEP_MESSAGES = 4
+CLEANUP_INTERVAL = 60
+
+SUMMARY_PROMPT = ('Кратко, в 2-3 предложениях, перескажи диалог абитуриента с приёмной комиссией МАИ: '
+                  'что спрашивал абитуриент и какие данные о себе сообщил (баллы, экзамены, направления).')
+
+
+def make_summarizer(model):
+    """Краткое содержание сообщений треда через модель completions"""
+
+    def summarize(messages):
+        history = '\n'.join(f'{msg["role"]}: {msg["text"]}' for msg in messages)
+        result = model.run([{'role': 'system', 'text': SUMMARY_PROMPT}, {'role': 'user', 'text': history}])
+        return result[0].text
+
+    return summarize
+
+
+class SessionManager:
+    """
+    Сессии пользователей бота: Agent и его облачный тред.
+    Неактивные дольше idle_timeout сессии и сессии сверх max_sessions (в порядке LRU) закрываются,
+    кроме ожидающих оператора. История треда ограничивается переносом последних сообщений в новый
+    тред раз в history_turns запросов. Новый тред после ответа пользователю готовит фоновый поток,
+    get() только подставляет готовый. Удаление тредов из облака выполняет тот же фоновый поток.
+    """
+
+    def __init__(self, factory, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS, history_turns=HISTORY_TURNS,
+                 keep_messages=KEEP_MESSAGES, summarize=None, cleanup_interval=CLEANUP_INTERVAL):
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.history_turns = history_turns
+        self.keep_messages = keep_messages
+        self.summarize = summarize
+        self.cleanup_interval = cleanup_interval
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._cleanup = queue.Queue()
+        # Подготовленные в фоне треды с сокращённой историей и пользователи, для которых подготовка в очереди
+        self._prepared = {}
+        self._trim_pending = set()
+        self.evicted = 0
+        self.trimmed = 0
+        self._thread = threading.Thread(target=self._run, name='session-cleanup', daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, user_id):
+        return user_id in self._sessions
+
+    def get(self, user_id):
+        """Сессия пользователя, при необходимости созданная; подставляется подготовленный тред с сокращённой историей"""
+        with self._lock:
+            agent = self._sessions.get(user_id)
+            if agent is not None:
+                self._sessions.move_to_end(user_id)
+        if agent is None:
+            agent = self.factory()
+            with self._lock:
+                # Сессию мог создать параллельный обработчик
+                agent = self._sessions.setdefault(user_id, agent)
+                self._sessions.move_to_end(user_id)
+                overflow = self._overflow()
+            for evicted in overflow:
+                self._retire(evicted.done)
+        self._apply_trim(user_id, agent)
+        return agent
+
+    def _apply_trim(self, user_id, agent):
+        with self._lock:
+            prepared = self._prepared.pop(user_id, None)
+        if prepared is None:
+            return
+        old = None if agent.get_handover() else agent.apply_trim(prepared)
+        if old is None:
+            # Пока тред готовился, пользователь задал новый вопрос: подготовка повторится после ответа
+            self._retire(prepared.thread.delete)
+            return
+        self.trimmed += 1
+        self._retire(old.delete)
+
+    def schedule_trim(self, user_id):
+        """Вызывается после ответа пользователю: если история выросла, новый тред готовится в фоне"""
+        with self._lock:
+            agent = self._sessions.get(user_id)
+            if (agent is None or not self.history_turns or agent.turns < self.history_turns
+                    or agent.get_handover() or user_id in self._trim_pending):
+                return
+            self._trim_pending.add(user_id)
+        self._cleanup.put(lambda: self._prepare_trim(user_id, agent))
+
+    def _prepare_trim(self, user_id, agent):
+        with self._lock:
+            self._trim_pending.discard(user_id)
+            if self._sessions.get(user_id) is not agent:
+                return
+        try:
+            prepared = agent.prepare_trim(self.keep_messages, self.summarize)
+        except Exception as e:
+            logger.warning(f"Не удалось сократить историю пользователя {user_id}: {e}")
+            return
+        if prepared is None:
+            return
+        with self._lock:
+            stale = self._prepared.pop(user_id, None)
+            if self._sessions.get(user_id) is agent:
+                self._prepared[user_id] = prepared
+            else:
+                stale, prepared = prepared, stale
+        if stale is not None:
+            stale.thread.delete()
+
+    def _drop_prepared(self, user_ids):
+        """Удаление подготовленных тредов закрытых сессий; вызывается под блокировкой"""
+        for user_id in user_ids:
+            prepared = self._prepared.pop(user_id, None)
+            if prepared is not None:
+                self._retire(prepared.thread.delete)
+
+    def _overflow(self):
+        """Сессии сверх max_sessions, начиная с давно неактивных; вызывается под блокировкой"""
+        overflow = []
+        excess = len(self._sessions) - self.max_sessions
+        for user_id in list(self._sessions):
+            if excess <= 0:
+                break
+            agent = self._sessions[user_id]
+            if agent.get_handover():
+                continue
+            overflow.append(self._sessions.pop(user_id))
+            self._drop_prepared([user_id])
+            excess -= 1
+        self.evicted += len(overflow)
+        return overflow
+
+    def close(self, user_id):
+        """Закрытие сессии; тред удаляется в фоне"""
+        with self._lock:
+            agent = self._sessions.pop(user_id, None)
+            self._drop_prepared([user_id])
+        if agent is not None:
+            self._retire(agent.done)
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self._lock:
+            idle = [user_id for user_id, agent in self._sessions.items()
+                    if now - agent.last_active > self.idle_timeout and not agent.get_handover()]
+            agents = [self._sessions.pop(user_id) for user_id in idle]
+            self._drop_prepared(idle)
+            self.evicted += len(agents)
+        for agent in agents:
+            self._retire(agent.done)
+        return len(agents)
+
+    def _retire(self, cleanup):
+        self._cleanup.put(cleanup)
+
+    def _run(self):
+        next_eviction = time.monotonic() + self.cleanup_interval
+        while True:
+            try:
+                cleanup = self._cleanup.get(timeout=max(0.0, next_eviction - time.monotonic()))
+            except queue.Empty:
+                cleanup = None
+            if cleanup is not None:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logger.warning(f"Ошибка фоновой задачи сессий: {e}")
+            if time.monotonic() >= next_eviction:
+                next_eviction = time.monotonic() + self.cleanup_interval
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    logger.exception(f"Ошибка при вытеснении сессий: {e}")
+
+    def stats(self):
+        return {
+            'sessions': len(self._sessions),
+            'evicted': self.evicted,
+            'trimmed': self.trimmed,
+            'pending_cleanup': self._cleanup.qsize(),
+        }
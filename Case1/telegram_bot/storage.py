@@ -0,0 +1,179 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    user_nick TEXT,
+    role TEXT NOT NULL DEFAULT 'user'
+);
+CREATE INDEX IF NOT EXISTS users_role ON users(role);
+
+CREATE TABLE IF NOT EXISTS queue (
+    position INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS dialogs (
+    user_id INTEGER NOT NULL UNIQUE,
+    admin_id INTEGER NOT NULL UNIQUE
+);
+'''
+
+
+class Storage:
+    """
+    Хранилище бота во встроенной базе SQLite: пользователи, очередь к оператору и активные диалоги.
+    Операции с очередью выполняются в транзакциях, множество администраторов кэшируется в памяти
+    и сбрасывается при изменении ролей. Бот ведёт очередь и диалоги в OperatorQueue, таблицы queue
+    и dialogs остаются источником для однократного переноса.
+    """
+
+    def __init__(self, db_path, users_json=None, callstack_json=None):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._admins = None
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._migrate(users_json, callstack_json)
+
+    def _transaction(self):
+        return _Transaction(self)
+
+    def _migrate(self, users_json, callstack_json):
+        """Однократный перенос данных из прежних users.json и callstack.json"""
+        with self._transaction() as cur:
+            if users_json and Path(users_json).exists() and not cur.execute('SELECT 1 FROM users').fetchone():
+                try:
+                    with open(users_json, 'r', encoding='utf-8') as f:
+                        users = json.load(f)
+                except (json.JSONDecodeError, IOError) as e:
+                    print(f"Ошибка при чтении файла: {e}")
+                    users = {}
+                cur.executemany('INSERT OR REPLACE INTO users(user_id, user_nick, role) VALUES (?, ?, ?)',
+                                [(int(user_id), data.get('user_nick'), data.get('role', 'user'))
+                                 for user_id, data in users.items()])
+            if callstack_json and Path(callstack_json).exists() and not (
+                    cur.execute('SELECT 1 FROM queue').fetchone() or cur.execute('SELECT 1 FROM dialogs').fetchone()):
+                try:
+                    with open(callstack_json, 'r', encoding='utf-8') as f:
+                        callstack = json.load(f)
+                except (json.JSONDecodeError, IOError) as e:
+                    print(f"Ошибка при чтении файла: {e}")
+                    callstack = {}
+                cur.executemany('INSERT OR IGNORE INTO queue(user_id) VALUES (?)',
+                                [(int(user_id),) for user_id in callstack.get('queue', [])])
+                cur.executemany('INSERT OR IGNORE INTO dialogs(user_id, admin_id) VALUES (?, ?)',
+                                [(int(user_id), int(admin_id)) for user_id, admin_id in callstack.get('dialogs', [])])
+
+    # Пользователи
+
+    def save_user(self, user_id, user_nick, role='user'):
+        with self._transaction() as cur:
+            cur.execute('INSERT OR REPLACE INTO users(user_id, user_nick, role) VALUES (?, ?, ?)',
+                        (int(user_id), user_nick, role))
+            # Сброс под той же блокировкой, что и заполнение кэша в admin_ids
+            self._admins = None
+
+    def update_user_role(self, user_id, new_role):
+        with self._transaction() as cur:
+            updated = cur.execute('UPDATE users SET role = ? WHERE user_id = ?', (new_role, int(user_id))).rowcount
+            self._admins = None
+        return updated > 0
+
+    def admin_ids(self):
+        """Множество ID администраторов (строками, как ключи прежнего users.json)"""
+        admins = self._admins
+        if admins is None:
+            # Чтение и запись кэша под блокировкой: сброс из save_user/update_user_role не может
+            # оказаться между ними, и устаревший набор не перезапишет сброшенный кэш
+            with self._lock:
+                admins = self._admins
+                if admins is None:
+                    rows = self.conn.execute("SELECT user_id FROM users WHERE role = 'admin'").fetchall()
+                    admins = self._admins = frozenset(str(row[0]) for row in rows)
+        return admins
+
+    def is_admin(self, user_id):
+        return str(user_id) in self.admin_ids()
+
+    # Очередь к оператору
+
+    def enqueue(self, user_id):
+        """Место пользователя в очереди, если он уже в ней, иначе постановка в конец и True"""
+        with self._transaction() as cur:
+            row = cur.execute('SELECT position FROM queue WHERE user_id = ?', (int(user_id),)).fetchone()
+            if row:
+                return cur.execute('SELECT COUNT(*) FROM queue WHERE position <= ?', row).fetchone()[0]
+            cur.execute('INSERT INTO queue(user_id) VALUES (?)', (int(user_id),))
+            return True
+
+    def queue_position(self, user_id):
+        with self._lock:
+            row = self.conn.execute('SELECT position FROM queue WHERE user_id = ?', (int(user_id),)).fetchone()
+            if not row:
+                return None
+            return self.conn.execute('SELECT COUNT(*) FROM queue WHERE position <= ?', row).fetchone()[0]
+
+    def export_queue(self):
+        """Очередь (в порядке постановки) и активные диалоги для переноса в OperatorQueue"""
+        with self._lock:
+            queue = [row[0] for row in self.conn.execute('SELECT user_id FROM queue ORDER BY position')]
+            dialogs = self.conn.execute('SELECT user_id, admin_id FROM dialogs').fetchall()
+        return queue, dialogs
+
+    # Диалоги
+
+    def create_dialog(self, admin_id):
+        """Атомарно снимает первого пользователя из очереди и соединяет его с администратором"""
+        with self._transaction() as cur:
+            if cur.execute('SELECT 1 FROM dialogs WHERE admin_id = ? OR user_id = ?',
+                           (int(admin_id), int(admin_id))).fetchone():
+                return False
+            row = cur.execute('SELECT position, user_id FROM queue ORDER BY position LIMIT 1').fetchone()
+            if not row:
+                return False
+            cur.execute('DELETE FROM queue WHERE position = ?', (row[0],))
+            cur.execute('INSERT INTO dialogs(user_id, admin_id) VALUES (?, ?)', (row[1], int(admin_id)))
+            return True
+
+    def get_visavi(self, user_id):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT admin_id FROM dialogs WHERE user_id = ? UNION ALL SELECT user_id FROM dialogs WHERE admin_id = ?',
+                (int(user_id), int(user_id))).fetchone()
+        return row[0] if row else False
+
+    def stop_dialog(self, user_id):
+        with self._transaction() as cur:
+            deleted = cur.execute('DELETE FROM dialogs WHERE user_id = ? OR admin_id = ?',
+                                  (int(user_id), int(user_id))).rowcount
+        return deleted > 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT под блокировкой хранилища, ROLLBACK при ошибке"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage._lock.acquire()
+        self.cur = self.storage.conn.cursor()
+        self.cur.execute('BEGIN IMMEDIATE')
+        return self.cur
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.cur.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.storage._lock.release()
+        return False
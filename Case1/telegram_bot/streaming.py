@@ -0,0 +1,89 @@
+import logging
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = 'Печатаю ответ…'
+# Telegram ограничивает частоту сообщений и правок в одном чате примерно одной в секунду
+EDIT_INTERVAL = 1.0
+# Правка отправляется, только если текст вырос хотя бы на столько символов
+MIN_DELTA = 20
+MAX_MESSAGE_LENGTH = 4096
+CURSOR = ' ▌'
+
+
+def retry_after(error):
+    """Пауза из ответа 429 Too Many Requests или None для остальных ошибок"""
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        return error.result_json.get('parameters', {}).get('retry_after', EDIT_INTERVAL)
+    return None
+
+
+def not_modified(error):
+    return isinstance(error, ApiTelegramException) and 'message is not modified' in str(error)
+
+
+class MessageStreamer:
+    """
+    Потоковый вывод ответа в Telegram: сразу отправляется сообщение-заглушка, которое затем
+    редактируется по мере генерации ответа не чаще раза в interval секунд. При ответе 429
+    промежуточные правки пропускаются до окончания паузы, итоговая правка дожидается её.
+    """
+
+    def __init__(self, bot, chat_id, placeholder=PLACEHOLDER, interval=EDIT_INTERVAL, min_delta=MIN_DELTA):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.min_delta = min_delta
+        self.message = bot.send_message(chat_id, placeholder)
+        self.sent_text = placeholder
+        self.next_edit = time.monotonic() + interval
+        self.edits = 0
+
+    def _edit(self, text, **kwargs):
+        try:
+            self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message.message_id, **kwargs)
+            self.sent_text = text
+            self.edits += 1
+        except Exception as e:
+            if not_modified(e):
+                return
+            pause = retry_after(e)
+            if pause is None:
+                raise
+            self.next_edit = time.monotonic() + pause
+            raise
+        finally:
+            self.next_edit = max(self.next_edit, time.monotonic() + self.interval)
+
+    def update(self, text):
+        """Промежуточный текст ответа; лишние правки отбрасываются"""
+        if time.monotonic() < self.next_edit or len(text) - len(self.sent_text) < self.min_delta:
+            return
+        try:
+            self._edit(text[:MAX_MESSAGE_LENGTH - len(CURSOR)] + CURSOR)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить сообщение в чате {self.chat_id}: {e}")
+
+    def finish(self, text, reply_markup=None):
+        """Итоговый текст: последняя правка заглушки, остаток длинного ответа - отдельными сообщениями.
+
+        reply_markup прикрепляется к последней части; возвращается последнее отправленное сообщение.
+        """
+        parts = [text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, len(text), MAX_MESSAGE_LENGTH)] or ['']
+        for attempt in range(3):
+            wait = self.next_edit - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self._edit(parts[0], reply_markup=reply_markup if len(parts) == 1 else None)
+                break
+            except Exception as e:
+                if retry_after(e) is None or attempt == 2:
+                    raise
+        last = self.message
+        for i, part in enumerate(parts[1:], 2):
+            last = self.bot.send_message(self.chat_id, part, reply_markup=reply_markup if i == len(parts) else None)
+        return last